@@ -145,11 +145,12 @@ class GitHubMonitor:
     return tree
 
   def generate_html_report(new_items, output_file=None):
-    from jinja2 import Template
+    import template_util
 
-    engine = Template(GitHubMonitor.__html_GitHub_report_template)
+    # compiled once per process
+    engine = template_util.get_inline_template(GitHubMonitor.__html_GitHub_report_template)
     tree = GitHubMonitor.__get_tree_from_records(new_items)
-    html = engine.render(results=tree)
+    html = template_util.render_template(engine, results=tree)
     if output_file:
       with codecs.open(output_file, 'w', "utf-8") as f:
         f.write(html)
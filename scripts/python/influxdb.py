@@ -2,11 +2,14 @@
 
 import datetime
 import os
+import time
+import threading
 # for struct-like class
 from dataclasses import dataclass
 # InfluxDB
 from influxdb_client import InfluxDBClient, Point, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
+from influxdb_client.rest import ApiException
 # logging
 from common import Logger, CLIParser
 logger = Logger.getLogger()
@@ -31,11 +34,12 @@ class InfluxDBHelper:
       logger.error(f"Failed to get InfluxDB configuration from ENV: {e}")
       raise
 
-  def __init__(self, influxDB_config):
+  def __init__(self, influxDB_config, enable_gzip=False):
     try:
       logger.debug(f"Initialize InfluxDB...")
       self._settings = influxDB_config
-      self._client = InfluxDBClient(url=influxDB_config.endpoint, token=influxDB_config.token)
+      self._pending_write = None
+      self._client = InfluxDBClient(url=influxDB_config.endpoint, token=influxDB_config.token, enable_gzip=enable_gzip)
       self._write_client = self._client.write_api(write_options=SYNCHRONOUS)
     except Exception as e:
       logger.error(f"Failed to initialize InfluxDB: {e}")
@@ -62,3 +66,59 @@ class InfluxDBHelper:
       self._write_client.write(self._settings.bucket, self._settings.tenant, point)
     except Exception as e:
       logger.error(f"Failed to report data to InfluxDB: {e}")
+
+  def create_points(category, records):
+    """Build points from (host, [(field, value)]) records, with distinct timestamps so same-host points don't overwrite"""
+    timestamp = time.time_ns()
+    points = []
+    for index, (host, data) in enumerate(records):
+      point = Point(category)
+      point.tag("host", host)
+      for field_key, field_value in data:
+        point.field(field_key, field_value)
+      point.time(timestamp + index, WritePrecision.NS)
+      points.append(point)
+    return points
+
+  def report_points(self, points, max_retries=3, retry_delay=5):
+    """Write all points in one line protocol request, returns (points written, latency in seconds)"""
+    lines = [line for line in (point.to_line_protocol() for point in points) if line]
+    if not lines:
+      return 0, 0
+    attempt = 0
+    while True:
+      try:
+        start = time.perf_counter()
+        self._write_client.write(self._settings.bucket, self._settings.tenant, "\n".join(lines), WritePrecision.NS)
+        return len(lines), time.perf_counter() - start
+      except Exception as e:
+        # client errors (other than throttling) won't succeed on retry
+        retriable = not isinstance(e, ApiException) or e.status is None or e.status == 429 or e.status >= 500
+        if isinstance(e, ApiException):
+          e = f"{e.status} {e.reason}"
+        if not retriable or attempt >= max_retries:
+          logger.error(f"Failed to report {len(lines)} points to InfluxDB: {e}")
+          return 0, None
+        delay = retry_delay * 2 ** attempt
+        attempt += 1
+        logger.warning(f"Failed to report data to InfluxDB, retry #{attempt} in {delay}s: {e}")
+        time.sleep(delay)
+
+  def report_points_async(self, points, max_retries=3, retry_delay=5):
+    """Write points in the background, call flush() to wait for the result"""
+    self.flush()
+    def write():
+      count, latency = self.report_points(points, max_retries, retry_delay)
+      if latency is not None:
+        logger.info(f"Stored {count} points into InfluxDB in {latency*1000:.0f} ms.")
+    self._pending_write = threading.Thread(target=write, name="influxdb-write", daemon=True)
+    self._pending_write.start()
+
+  def flush(self, timeout=None):
+    """Wait for background write to complete, returns False if still running"""
+    if self._pending_write:
+      self._pending_write.join(timeout)
+      if self._pending_write.is_alive():
+        return False
+      self._pending_write = None
+    return True
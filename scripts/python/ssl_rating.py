@@ -11,7 +11,9 @@ Dictionary-based configuration (recommended):
     "use_ssllabs": False,  # True for SSLLabs API, False for local TestSSL.sh
     "local_scanner": "/opt/testssl.sh/testssl.sh",
     "openssl_path": "/usr/bin/openssl", 
-    "show_progress": True
+    "show_progress": True,
+    "max_scans": 2,
+    "scan_interval": 15
   }
   
   # Load configuration
@@ -26,17 +28,23 @@ ConfigParser section (backward compatibility):
   LocalScanner=/opt/testssl.sh/testssl.sh
   OpenSSLPath=/usr/bin/openssl
   ShowProgress=yes
+  MaxScans=2
+  ScanInterval=15
+  RatingCacheFile=/config/ssl-rating-cache.json
+  RatingCacheMaxAge=168
 """
 
 import os
 import json
 import time
+import threading
+import tempfile
+import collections
+import concurrent.futures
 import datetime
-import socket
 import ssl
 from dataclasses import dataclass
 from urllib.parse import urlparse
-import requests
 import web_util
 from common import Logger
 
@@ -53,85 +61,161 @@ class SSLRecord:
   grade: str = ''
   expires: str = ''
   error: str = ''
+  # seconds waiting for a scanner slot and scanning (0 if not scanned locally, e.g. cached)
+  queue_time: float = 0.0
+  scan_time: float = 0.0
 
 class APIThrottlingException(Exception):
    """Raised when the API throttling happens"""
-   pass
+   def __init__(self, message, status_code=None):
+     super().__init__(message)
+     self.status_code = status_code
 
 class SSLLabs:
-  """SSLLabs API client for SSL certificate analysis"""
-  
+  """SSLLabs API client for SSL certificate analysis, running as many assessments as the API allows"""
+
+  _lock = threading.Lock()
+  _waiting = collections.deque()  # URLs not submitted yet
+  _pending = {}                   # URL -> assessment state
+  _scheduler = None
+  _poll_interval = 10             # seconds between polls of one assessment
+  _max_wait = 1200                # seconds before an assessment is considered timed out
+  _overload_delay = 900           # seconds to back off when the service is overloaded (529)
+
   @staticmethod
   def __analyze_api_call(params):
     analyze_endpoint = 'https://api.ssllabs.com/api/v3/analyze'
-    # force 2 seconds sleep to avoid hitting 529 (newAssessmentCoolOff)
-    time.sleep(2)
     headers = {
       "User-Agent": web_util.get_user_agent()
     }
-    r = requests.get(analyze_endpoint, params=params, headers=headers)
+    r = web_util.get_http_session().get(analyze_endpoint, params=params, headers=headers)
     if r.status_code == 429 or r.status_code == 529:
-      raise APIThrottlingException(f"SSLLabs API throttled: error={r.status_code}")
+      raise APIThrottlingException(f"SSLLabs API throttled: error={r.status_code}", r.status_code)
     elif r.status_code > 400:
       raise Exception(f"SSLLabs API failed: error={r.status_code}")
     return r.json()
 
   @staticmethod
-  def __track_server_load():
+  def __get_server_info():
+    """Get (free assessment slots, cool-off seconds) from the info endpoint, free slots are None if unknown"""
     try:
       info_endpoint = 'https://api.ssllabs.com/api/v3/info'
-      # force 2 seconds sleep to avoid hitting 529 (newAssessmentCoolOff)
-      time.sleep(2)
       headers = {
         "User-Agent": web_util.get_user_agent()
       }
-      r = requests.get(info_endpoint, headers=headers)
+      r = web_util.get_http_session().get(info_endpoint, headers=headers)
       if r.status_code > 400:
         logger.error(f"SSLLabs API failed: error={r.status_code}")
-        return
-
-      # log the current load
+        return None, 2
       result = r.json()
-      logger.info(f"SSLLabs server info: load={result['currentAssessments']}/{result['maxAssessments']}, yield={result['newAssessmentCoolOff']/1000}s")
+      if 'DEBUG' in os.environ:
+        logger.info(f"SSLLabs server info: load={result['currentAssessments']}/{result['maxAssessments']}, yield={result['newAssessmentCoolOff']/1000}s")
+      return result['maxAssessments'] - result['currentAssessments'], result['newAssessmentCoolOff'] / 1000
     except Exception as e:
       logger.error(f"Failed to get server info: {e}")
+      # documented default cool-off
+      return None, 2
 
   @staticmethod
-  def __analyze_server(url):
-    parsed_uri = urlparse(url)
-    if parsed_uri.scheme != 'https':
-      raise Exception(f"Invalid URL to scan: {url}")
+  def __complete(url, result=None, error=None):
+    with SSLLabs._lock:
+      state = SSLLabs._pending.pop(url)
+    if error:
+      state["future"].set_exception(error)
+    else:
+      state["future"].set_result(result)
 
-    payload = { 'host': url, 'fromCache': 'on', 'maxAge': 24 }
-    result = SSLLabs.__analyze_api_call(payload)
-    for i in range(0, 20):
-      if result['status'].lower() == 'ready':
-        return result
-      elif result['status'].lower() == 'error':
-        raise Exception(f"SSLLabs API error: {result['statusMessage']}")
+  @staticmethod
+  def __handle_result(url, result):
+    """Complete the assessment if the API reached a conclusion, returns True if done"""
+    status = result['status'].lower()
+    if status == 'ready':
+      SSLLabs.__complete(url, result)
+      return True
+    elif status == 'error':
+      SSLLabs.__complete(url, error=Exception(f"SSLLabs API error: {result['statusMessage']}"))
+      return True
+    return False
 
-      # wait until we have a conclusion or timeout
-      time.sleep(60)
-      result = SSLLabs.__analyze_api_call(payload)
-    raise Exception(f"Analyzing SSL timed out: {url}")
+  @staticmethod
+  def __schedule():
+    """Submit new assessments while there is capacity and poll all pending ones in one loop"""
+    next_submit = 0
+    while True:
+      with SSLLabs._lock:
+        if not SSLLabs._waiting and not SSLLabs._pending:
+          SSLLabs._scheduler = None
+          return
+        submitted = [url for url, state in SSLLabs._pending.items() if state["started"]]
+      now = time.monotonic()
+      # submit as many new assessments as the server currently accepts
+      if SSLLabs._waiting and now >= next_submit:
+        free, cool_off = SSLLabs.__get_server_info()
+        # without free slots (or when /info failed), ask again only after a poll interval
+        hold_until = time.monotonic() + max(cool_off, SSLLabs._poll_interval) if free is None or free <= 0 else 0
+        if free is None:
+          # be conservative: one at a time
+          free = 1
+        while free > 0 and SSLLabs._waiting and time.monotonic() >= next_submit:
+          url = SSLLabs._waiting.popleft()
+          try:
+            result = SSLLabs.__analyze_api_call({'host': url, 'fromCache': 'on', 'maxAge': 24})
+            SSLLabs._pending[url]["started"] = SSLLabs._pending[url]["polled"] = time.monotonic()
+            SSLLabs.__handle_result(url, result)
+            free -= 1
+            next_submit = time.monotonic() + cool_off
+            if free > 0 and cool_off > 0:
+              time.sleep(cool_off)
+          except APIThrottlingException as e:
+            SSLLabs._waiting.appendleft(url)
+            delay = SSLLabs._overload_delay if e.status_code == 529 else max(cool_off, SSLLabs._poll_interval)
+            logger.info(f"{e}, holding new assessments for {delay}s.")
+            next_submit = time.monotonic() + delay
+            break
+          except Exception as e:
+            SSLLabs.__complete(url, error=e)
+        next_submit = max(next_submit, hold_until)
+      # poll every started assessment that is due
+      for url in submitted:
+        state = SSLLabs._pending.get(url)
+        if not state or time.monotonic() - state["polled"] < SSLLabs._poll_interval:
+          continue
+        state["polled"] = time.monotonic()
+        try:
+          result = SSLLabs.__analyze_api_call({'host': url, 'fromCache': 'on', 'maxAge': 24})
+          if not SSLLabs.__handle_result(url, result) and \
+             time.monotonic() - state["started"] > SSLLabs._max_wait:
+            SSLLabs.__complete(url, error=Exception(f"Analyzing SSL timed out: {url}"))
+        except APIThrottlingException as e:
+          logger.debug(f"{e}, polling {url} later.")
+        except Exception as e:
+          SSLLabs.__complete(url, error=e)
+      time.sleep(1)
 
   @staticmethod
-  def get_site_rating(url):
-    """Get SSL rating from SSLLabs for a given URL"""
+  def submit(url):
+    """Queue an assessment, returns a future with the raw API result"""
+    parsed_uri = urlparse(url)
+    future = concurrent.futures.Future()
+    if parsed_uri.scheme != 'https':
+      future.set_exception(Exception(f"Invalid URL to scan: {url}"))
+      return future
+    with SSLLabs._lock:
+      if url in SSLLabs._pending:
+        # same host already being assessed
+        return SSLLabs._pending[url]["future"]
+      SSLLabs._pending[url] = {"future": future, "started": None, "polled": None}
+      SSLLabs._waiting.append(url)
+      if not SSLLabs._scheduler:
+        SSLLabs._scheduler = threading.Thread(target=SSLLabs.__schedule, name="ssllabs", daemon=True)
+        SSLLabs._scheduler.start()
+    return future
+
+  @staticmethod
+  def __get_ratings(url, future):
     ratings = []
     try:
-      # track SSLLabs server load
-      if 'DEBUG' in os.environ:
-        SSLLabs.__track_server_load()
-      # start new assessment
-      try:
-        logger.debug(f"Checking SSL rating for {url}...")
-        result = SSLLabs.__analyze_server(url)
-      except APIThrottlingException:
-        # retry after a while if throttled
-        logger.info("Sleeping for a while to avoid further throttling.")
-        time.sleep(1000)
-        result = SSLLabs.__analyze_server(url)
+      result = future.result()
       endpoints = result['endpoints']
       parsed_uri = urlparse(url)
       report_url = f"https://www.ssllabs.com/ssltest/analyze.html?d={parsed_uri.hostname}&hideResults=on"
@@ -151,59 +235,177 @@ class SSLLabs:
       logger.error(f"{e}")
       return [SSLRecord(url=url, grade='Error', error=f"{e}")]
 
+  @staticmethod
+  def submit_rating(url):
+    """Queue an assessment, returns a future with the list of SSLRecord"""
+    logger.debug(f"Checking SSL rating for {url}...")
+    ratings = concurrent.futures.Future()
+    SSLLabs.submit(url).add_done_callback(lambda future: ratings.set_result(SSLLabs.__get_ratings(url, future)))
+    return ratings
+
+  @staticmethod
+  def get_site_rating(url):
+    """Get SSL rating from SSLLabs for a given URL"""
+    return SSLLabs.submit_rating(url).result()
+
 class TestSSL_sh:
-  """Local TestSSL.sh scanner for SSL certificate analysis"""
-  
+  """Local TestSSL.sh scanner for SSL certificate analysis, running a bounded number of scans at once"""
+
+  _max_scans = 2
+  _scan_interval = 15
+  _executor = None
+  _lock = threading.Lock()
+  _target_limits = {}
+
   @staticmethod
-  def set_config(local_scanner, openssl_path, show_progress):
+  def set_config(local_scanner, openssl_path, show_progress, max_scans=2, scan_interval=15):
     TestSSL_sh._local_scanner = local_scanner
     TestSSL_sh._openssl_scanner = openssl_path
     TestSSL_sh._show_progress = show_progress
+    TestSSL_sh._max_scans = max(1, max_scans)
+    # minimum seconds between two scans of the same target, to reduce server impact
+    TestSSL_sh._scan_interval = scan_interval
+
+  @staticmethod
+  def __get_executor():
+    with TestSSL_sh._lock:
+      if not TestSSL_sh._executor:
+        TestSSL_sh._executor = concurrent.futures.ThreadPoolExecutor(
+          max_workers=TestSSL_sh._max_scans, thread_name_prefix="testssl")
+      return TestSSL_sh._executor
+
+  @staticmethod
+  def __get_target_limit(host):
+    with TestSSL_sh._lock:
+      if host not in TestSSL_sh._target_limits:
+        rate = 1 / TestSSL_sh._scan_interval if TestSSL_sh._scan_interval > 0 else 0
+        TestSSL_sh._target_limits[host] = web_util.TokenBucket(rate)
+      return TestSSL_sh._target_limits[host]
 
   @staticmethod
   def __exec_cmd(args):
-    time.sleep(15) # adding some delay to reduce server impact
     import subprocess
     if TestSSL_sh._show_progress:
-      run_result = subprocess.run(args.split())
+      run_result = subprocess.run(args)
     else:
-      run_result = subprocess.run(args.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+      run_result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if run_result.stderr:
       logger.error(f"Error: {run_result.stderr}")
 
   @staticmethod
-  def get_site_rating(url):
-    """Get SSL rating using local TestSSL.sh scanner"""
-    import random
+  def __scan(url, submitted):
     ratings = []
+    started = None
     try:
+      parsed_uri = urlparse(url)
+      TestSSL_sh.__get_target_limit(parsed_uri.hostname).acquire()
+      started = time.monotonic()
       logger.debug(f"Checking SSL rating for {url}... (Testssl.sh)")
-      # execute testssl.sh and get json output
-      jsonfile = f"/tmp/{random.randint(1, 1000000)}.json"
-      args = f"{TestSSL_sh._local_scanner} " \
-             f"--openssl={TestSSL_sh._openssl_scanner} --fast --ip one " \
-             f"--quiet --jsonfile-pretty {jsonfile} " \
-             f"{url}"
-      TestSSL_sh.__exec_cmd(args)
-      cmd_json_out = {}
-      with open(jsonfile, "r") as f:
-        cmd_json_out = json.load(f)
-      os.remove(jsonfile)
+      # execute testssl.sh and get json output (it refuses to overwrite files, so use a fresh folder)
+      with tempfile.TemporaryDirectory(prefix="testssl-") as work_dir:
+        jsonfile = os.path.join(work_dir, "result.json")
+        args = [TestSSL_sh._local_scanner,
+                f"--openssl={TestSSL_sh._openssl_scanner}", "--fast", "--ip", "one",
+                "--quiet", "--jsonfile-pretty", jsonfile,
+                url]
+        TestSSL_sh.__exec_cmd(args)
+        with open(jsonfile, "r") as f:
+          cmd_json_out = json.load(f)
+      queue_time, scan_time = round(started - submitted, 1), round(time.monotonic() - started, 1)
       # parse json file
       list_ratings = cmd_json_out['scanResult'][0]['rating']
       json_rating = next(x for x in list_ratings if x["id"] == "overall_grade")
       grade = json_rating["finding"]
-      logger.info(f"Grade: {grade} [{url}]")
+      logger.info(f"Grade: {grade} [{url}] (queued {queue_time}s, scanned in {scan_time}s)")
       # assemble report
-      parsed_uri = urlparse(url)
       report_url = f"https://www.ssllabs.com/ssltest/analyze.html?d={parsed_uri.hostname}&hideResults=on"
-      rating = SSLRecord(url=url, report=report_url)
+      rating = SSLRecord(url=url, report=report_url, queue_time=queue_time, scan_time=scan_time)
       rating.grade = grade
       ratings.append(rating)
       return ratings
     except Exception as e:
       logger.error(f"{e}")
-      return [SSLRecord(url=url, grade='Error', error=f"{e}")]
+      rating = SSLRecord(url=url, grade='Error', error=f"{e}")
+      if started is not None:
+        rating.queue_time, rating.scan_time = round(started - submitted, 1), round(time.monotonic() - started, 1)
+      return [rating]
+
+  @staticmethod
+  def submit(url):
+    """Queue a scan, returns a future with the list of SSLRecord"""
+    return TestSSL_sh.__get_executor().submit(TestSSL_sh.__scan, url, time.monotonic())
+
+  @staticmethod
+  def get_site_rating(url):
+    """Get SSL rating using local TestSSL.sh scanner"""
+    return TestSSL_sh.submit(url).result()
+
+class SSLRatingCache:
+  """On-disk cache of SSL ratings keyed by host and IP, each entry expiring on its own"""
+
+  # hosts behind several servers may present different certificates, all of them are accepted
+  _MAX_FINGERPRINTS = 8
+
+  def __init__(self, cache_file, max_age_hours):
+    self._cache_file = cache_file
+    self._max_age = max_age_hours * 3600
+    self._lock = threading.Lock()
+    self._hosts = {}
+    try:
+      if os.path.isfile(cache_file):
+        with open(cache_file, "r") as f:
+          self._hosts = json.load(f)
+        logger.debug(f"SSL rating cache loaded: {len(self._hosts)} hosts.")
+    except Exception as e:
+      logger.warning(f"Ignoring SSL rating cache [{cache_file}]: {e}")
+
+  def _save(self):
+    try:
+      web_util.save_json(self._cache_file, self._hosts, indent=1)
+    except Exception as e:
+      logger.warning(f"Failed to save SSL rating cache [{self._cache_file}]: {e}")
+
+  def get(self, url, fingerprint=None):
+    """Get cached ratings of the URL's host, None if missing, expired or the certificate is not a known one"""
+    host = urlparse(url).netloc
+    with self._lock:
+      entry = self._hosts.get(host)
+      if not entry:
+        return None
+      fingerprints = SSLRatingCache._get_fingerprints(entry)
+      if fingerprint and fingerprints and fingerprint not in fingerprints:
+        # rated again, the new certificate is added by put()
+        logger.info(f"New certificate seen, not using cached SSL rating of {host}")
+        return None
+      now = time.time()
+      records = entry["records"]
+      if not records or any(now - record["time"] > self._max_age for record in records.values()):
+        return None
+      return [SSLRecord(url=url, ip=ip, grade=record["grade"], report=record["report"])
+              for ip, record in records.items()]
+
+  @staticmethod
+  def _get_fingerprints(entry):
+    # entries saved before several certificates were kept have a single "fingerprint"
+    if "fingerprints" in entry:
+      return entry["fingerprints"]
+    return [entry["fingerprint"]] if entry.get("fingerprint") else []
+
+  def put(self, url, fingerprint, ratings):
+    """Store good ratings of the URL's host, keyed by IP"""
+    if any(rating.error or rating.grade == 'Error' for rating in ratings):
+      return
+    host = urlparse(url).netloc
+    now = time.time()
+    with self._lock:
+      fingerprints = SSLRatingCache._get_fingerprints(self._hosts.get(host, {}))
+      if fingerprint:
+        fingerprints = [fp for fp in fingerprints if fp != fingerprint] + [fingerprint]
+      self._hosts[host] = {
+        "fingerprints": fingerprints[-SSLRatingCache._MAX_FINGERPRINTS:],
+        "records": {rating.ip: {"grade": rating.grade, "report": rating.report, "time": now} for rating in ratings}
+      }
+      self._save()
 
 @dataclass
 class SSLScannerConfig:
@@ -213,27 +415,55 @@ class SSLScannerConfig:
   local_scanner: str = None
   openssl_path: str = None
   show_progress: bool = False
+  max_scans: int = 2
+  scan_interval: int = 15
+  cache_file: str = None
+  cache_max_age: int = 0
 
 class SSLReport:
   """Main SSL reporting class that coordinates between different scanners"""
   
+  _cache = None
+
   @staticmethod
   def set_config(settings):
     SSLReport._settings = settings
     if not settings.use_ssllabs:
-      TestSSL_sh.set_config(settings.local_scanner, settings.openssl_path, settings.show_progress)
+      TestSSL_sh.set_config(settings.local_scanner, settings.openssl_path, settings.show_progress,
+                            settings.max_scans, settings.scan_interval)
+    if settings.cache_file and settings.cache_max_age > 0:
+      SSLReport._cache = SSLRatingCache(settings.cache_file, settings.cache_max_age)
 
   @staticmethod
   def should_get_rating():
     return SSLReport._settings.generate_rating
 
   @staticmethod
-  def get_site_rating(url):
-    """Get SSL rating using configured scanner (SSLLabs or TestSSL.sh)"""
+  def submit_site_rating(url, fingerprint=None):
+    """Start getting SSL rating using configured scanner (SSLLabs or TestSSL.sh), or from cache if still valid
+
+    Returns a future with the list of SSLRecord, so many sites can be rated while the scanner's own queue
+    decides how many run at once."""
+    cache = SSLReport._cache
+    if cache:
+      ratings = cache.get(url, fingerprint)
+      if ratings:
+        logger.debug(f"Using cached SSL rating for {url}")
+        future = concurrent.futures.Future()
+        future.set_result(ratings)
+        return future
     if (SSLReport._settings.use_ssllabs):
-      return SSLLabs.get_site_rating(url)
+      future = SSLLabs.submit_rating(url)
     else :
-      return TestSSL_sh.get_site_rating(url)
+      future = TestSSL_sh.submit(url)
+    if cache:
+      future.add_done_callback(lambda done: cache.put(url, fingerprint, done.result()))
+    return future
+
+  @staticmethod
+  def get_site_rating(url, fingerprint=None):
+    """Get SSL rating using configured scanner (SSLLabs or TestSSL.sh), or from cache if still valid"""
+    return SSLReport.submit_site_rating(url, fingerprint).result()
 
   @staticmethod
   def __get_ssl_expiration_date(host, ip=None, port=443):
@@ -245,7 +475,7 @@ class SSLReport:
         port = 443
       #logger.debug(f"Getting SSL certificate info: {ip}:{port}")
       context = ssl.create_default_context()
-      with socket.create_connection((ip, port)) as sock:
+      with web_util.create_connection(ip, port) as sock:
         with context.wrap_socket(sock, server_hostname=host) as ssock:
           cert_info = ssock.getpeercert()
           ssl_date_fmt = r'%b %d %H:%M:%S %Y %Z'
@@ -259,6 +489,17 @@ class SSLReport:
         error = None
       return None, error
 
+  @staticmethod
+  def get_ssl_expiration_record(url, ip, expires):
+    """Get SSL certificate expiration information from an already known expiration date"""
+    result = SSLRecord(url=url, ip=ip)
+    expires_in_days = (expires - datetime.datetime.now()).days
+    result.expires = expires_in_days
+    if (expires_in_days < 7):
+      result.error = "Certificate will expire soon!"
+      logger.error(result.error)
+    return result
+
   @staticmethod
   def get_ssl_expires_in_days(url, ip=None, check_endpoints=False, get_ip_addresses_func=None, is_host_reachable_func=None):
     """Get SSL certificate expiration information"""
@@ -288,11 +529,7 @@ class SSLReport:
           continue
         result.error = error
       elif expires:
-        expires_in_days = (expires - datetime.datetime.now()).days
-        result.expires = expires_in_days
-        if (expires_in_days < 7):
-          result.error = "Certificate will expire soon!"
-          logger.error(result.error)
+        result = SSLReport.get_ssl_expiration_record(url, ip, expires)
       results.append(result)
     if not results:
       # if comes here, means all DNS glitches
@@ -306,11 +543,15 @@ def create_ssl_config(config_dict):
   settings = SSLScannerConfig()
   settings.generate_rating = config_dict.get("generate_rating", False)
   settings.use_ssllabs = config_dict.get("use_ssllabs", False)
+  settings.cache_file = config_dict.get("cache_file")
+  settings.cache_max_age = config_dict.get("cache_max_age", 0)
   
   if not settings.use_ssllabs:
     settings.local_scanner = config_dict.get("local_scanner", "").strip('\" ')
     settings.openssl_path = config_dict.get("openssl_path", "").strip('\" ')
     settings.show_progress = config_dict.get("show_progress", False)
+    settings.max_scans = config_dict.get("max_scans", 2)
+    settings.scan_interval = config_dict.get("scan_interval", 15)
 
     if settings.generate_rating and \
       ((not settings.local_scanner) or \
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import jinja2
+import common
+
+# Initialize logger
+logger = common.Logger.getLogger()
+
+class TemplateEngine:
+  """Shared Jinja2 environments: templates are compiled once and only recompiled when the file changes"""
+
+  _lock = threading.Lock()
+  _environments = {}  # template directory -> environment
+  _inline_environment = None
+  _inline_templates = {}  # template source -> compiled template
+  _bytecode_cache_dir = None  # None: Jinja2's per-user temp directory
+
+  @staticmethod
+  def configure(bytecode_cache_dir=None):
+    with TemplateEngine._lock:
+      if bytecode_cache_dir is not None and bytecode_cache_dir != TemplateEngine._bytecode_cache_dir:
+        os.makedirs(bytecode_cache_dir, exist_ok=True)
+        TemplateEngine._bytecode_cache_dir = bytecode_cache_dir
+        TemplateEngine._environments = {}
+
+  @staticmethod
+  def get_environment(template_dir):
+    template_dir = os.path.abspath(template_dir)
+    with TemplateEngine._lock:
+      env = TemplateEngine._environments.get(template_dir)
+      if env is None:
+        # auto_reload compares the file's mtime with the one it was compiled from
+        env = jinja2.Environment(
+          loader=jinja2.FileSystemLoader(template_dir),
+          bytecode_cache=jinja2.FileSystemBytecodeCache(TemplateEngine._bytecode_cache_dir),
+          auto_reload=True)
+        TemplateEngine._environments[template_dir] = env
+      return env
+
+  @staticmethod
+  def get_template(template_file):
+    env = TemplateEngine.get_environment(os.path.dirname(template_file) or ".")
+    return env.get_template(os.path.basename(template_file))
+
+  @staticmethod
+  def get_inline_template(source):
+    with TemplateEngine._lock:
+      template = TemplateEngine._inline_templates.get(source)
+      if template is None:
+        if TemplateEngine._inline_environment is None:
+          TemplateEngine._inline_environment = jinja2.Environment()
+        template = TemplateEngine._inline_environment.from_string(source)
+        TemplateEngine._inline_templates[source] = template
+      return template
+
+  @staticmethod
+  def render(template, **context):
+    """Render a template (file path or compiled template)"""
+    if not isinstance(template, jinja2.Template):
+      template = TemplateEngine.get_template(template)
+    return template.render(**context)
+
+def configure_templates(bytecode_cache_dir=None):
+  TemplateEngine.configure(bytecode_cache_dir)
+
+def get_template(template_file):
+  return TemplateEngine.get_template(template_file)
+
+def get_inline_template(source):
+  return TemplateEngine.get_inline_template(source)
+
+def render_template(template, **context):
+  return TemplateEngine.render(template, **context)
@@ -2,6 +2,8 @@
 
 import os
 import sys
+import time
+import threading
 import unittest
 
 # Import the modules we want to test
@@ -17,6 +19,7 @@ spec.loader.exec_module(web_monitor)
 
 # Also import web utilities
 import web_util
+import ssl_rating
 
 # Now we can access the classes
 SiteInfo = web_monitor.SiteInfo
@@ -35,7 +38,268 @@ class SiteInfoTestCase(unittest.TestCase):
     report = SiteInfo.get_report("https://www.indiaglitz.com", False)
     self.assertEqual(len(report), 1, 'wrong number of records')
 
+class WebUtilsTestCase(unittest.TestCase):
+  def test_dns_cache(self):
+    web_util.flush_dns_cache()
+    stats = web_util.get_dns_stats()
+    addresses, error = web_util.get_ip_addresses('localhost', 443)
+    self.assertIsNone(error)
+    self.assertIn('127.0.0.1', addresses)
+    web_util.get_ip_addresses('localhost', 443)
+    self.assertEqual(web_util.get_dns_stats()['hits'], stats['hits'] + 1, 'second lookup not cached')
+    # unknown names are cached too
+    self.assertFalse(web_util.is_valid_dns('www.example.invalid')[0])
+    self.assertFalse(web_util.is_valid_dns('www.example.invalid')[0])
+    self.assertEqual(web_util.get_dns_stats()['hits'], stats['hits'] + 2, 'negative lookup not cached')
+
+  def test_phase_timings_with_redirect(self):
+    import http.server
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+      protocol_version = 'HTTP/1.1'
+
+      def do_GET(self):
+        if self.path == '/':
+          self.send_response(302)
+          self.send_header('Location', '/en/')
+          self.send_header('Content-Length', '0')
+          self.end_headers()
+        else:
+          self.send_response(200)
+          self.send_header('Content-Length', '2')
+          self.end_headers()
+          self.wfile.write(b'ok')
+
+      def log_message(self, *args):
+        pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    getaddrinfo = web_util.DNSCache.getaddrinfo
+
+    def slow_getaddrinfo(*args, **kwargs):
+      time.sleep(0.1)
+      return getaddrinfo(*args, **kwargs)
+
+    web_util.DNSCache.getaddrinfo = staticmethod(slow_getaddrinfo)
+    try:
+      r = web_util.get_http_session().get(f'http://localhost:{server.server_port}/', stream=True)
+      r.close()
+      # the redirect is followed on the same keep-alive connection, set up by the first request
+      self.assertEqual(len(r.history), 1)
+      self.assertGreaterEqual(web_util.get_phase_timings(r)['dns'], 100, 'setup time of the redirect lost')
+    finally:
+      web_util.DNSCache.getaddrinfo = staticmethod(getaddrinfo)
+      server.shutdown()
+
+  def test_probe_ipv6_only_host(self):
+    import socket
+    import dns.resolver
+
+    class Answer:
+      def __init__(self, address):
+        self.rrset = type('RRset', (), {'ttl': 60})()
+        self._records = [type('Record', (), {'address': address})()]
+
+      def __iter__(self):
+        return iter(self._records)
+
+    class IPv6OnlyResolver:
+      nameservers = ['192.0.2.53']
+
+      def resolve(self, host, rdtype):
+        if rdtype == 'A':
+          raise dns.resolver.NoAnswer()
+        return Answer('::1')
+
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as listener:
+      listener.bind(('::1', 0))
+      listener.listen()
+      port = listener.getsockname()[1]
+      latencies = web_util.probe_endpoints('ipv6-only.example.com', port, timeout=5, resolver=IPv6OnlyResolver())
+    self.assertEqual(list(latencies), ['::1'])
+    self.assertIsNotNone(latencies['::1'], 'IPv6 address not probed')
+
+  def test_save_json(self):
+    import datetime
+    import tempfile
+    with tempfile.TemporaryDirectory() as work_dir:
+      path = os.path.join(work_dir, 'cache.json')
+      web_util.save_json(path, {'a': 1})
+      # a value JSON can't hold keeps the previous file and leaves no temporary file behind
+      with self.assertRaises(TypeError):
+        web_util.save_json(path, {'a': datetime.time(0, 30)})
+      self.assertEqual(os.listdir(work_dir), ['cache.json'])
+      with open(path) as f:
+        self.assertEqual(f.read(), '{"a": 1}')
+
+class CircuitBreakerTestCase(unittest.TestCase):
+  # the breaker is process-wide, so later tests get back its config and no state for the test host
+  def setUp(self):
+    self._config = (web_util.CircuitBreaker._threshold, web_util.CircuitBreaker._cooldown)
+
+  def tearDown(self):
+    web_util.configure_circuit_breaker(*self._config)
+    with web_util.CircuitBreaker._lock:
+      web_util.CircuitBreaker._hosts.pop(('127.0.0.1', 1), None)
+
+  def test_circuit_breaker(self):
+    url = 'http://127.0.0.1:1/'
+    web_util.configure_circuit_breaker(threshold=2, cooldown=0)
+    stats = web_util.get_circuit_stats()
+    web_util.record_circuit_failure(url)
+    self.assertTrue(web_util.circuit_allows(url), 'opened too early')
+    web_util.record_circuit_failure(url)
+    self.assertEqual(web_util.get_circuit_stats()['opened'], stats['opened'] + 1)
+    # half-open TCP probe to a closed port keeps it open
+    self.assertFalse(web_util.circuit_allows(url), 'not short-circuited')
+    web_util.record_circuit_success(url)
+    self.assertEqual(web_util.get_circuit_stats()['closed'], stats['closed'] + 1)
+    self.assertTrue(web_util.circuit_allows(url))
+
+class StartupTestCase(unittest.TestCase):
+  # cron starts web-monitor many times a day, heavy modules are imported on first use
+  LAZY_MODULES = ('jinja2', 'openpyxl', 'influxdb_client', 'sendgrid', 'dns.resolver')
+
+  def _imported_modules(self):
+    """Run web-monitor.py -h with -X importtime, returns the names of all modules it imported"""
+    import subprocess
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    cmd = [sys.executable, '-X', 'importtime', 'web-monitor.py', '-h']
+    result = subprocess.run(cmd, cwd=script_dir, capture_output=True, text=True)
+    imported = set()
+    for line in result.stderr.splitlines():
+      if line.startswith('import time:') and '|' in line:
+        imported.add(line.split('|')[-1].strip())
+    return imported
+
+  def test_lazy_imports(self):
+    # checks what is imported rather than how long it takes, which depends on the machine
+    imported = self._imported_modules()
+    self.assertIn('web_util', imported)
+    for module in self.LAZY_MODULES:
+      self.assertNotIn(module, imported, f'{module} imported at startup')
+
+class KeywordScannerTestCase(unittest.TestCase):
+  def test_keyword_across_chunks(self):
+    scanner = web_monitor.KeywordScanner(['Hello World', 'missing'])
+    # the keyword spans three chunks, the middle one shorter than the keyword
+    for chunk in [b'<p>say hel', b'lo w', b'ORLD</p>']:
+      scanner.feed(chunk)
+    self.assertEqual(scanner.found, {'Hello World'})
+    self.assertFalse(scanner.is_done(), 'missing keyword reported found')
+
+  def test_empty_keyword(self):
+    scanner = web_monitor.KeywordScanner([''])
+    self.assertTrue(scanner.is_done())
+    scanner.feed(b'anything')
+    self.assertEqual(scanner.found, set())
+    scanner = web_monitor.KeywordScanner(['', 'ok'])
+    scanner.feed(b'all OK')
+    self.assertEqual(scanner.found, {'ok'})
+    self.assertTrue(scanner.is_done())
+
+class LatencyHistogramTestCase(unittest.TestCase):
+  def test_percentile(self):
+    LatencyHistogram = web_monitor.LatencyHistogram
+    histogram = LatencyHistogram()
+    self.assertIsNone(histogram.get_percentile(99))
+    for _ in range(100):
+      histogram.add(100)
+    histogram.add(5000)
+    # upper bound of the bucket, within about 9%
+    self.assertTrue(100 <= histogram.get_percentile(50) <= 110)
+    self.assertTrue(100 <= histogram.get_percentile(99) <= 110)
+    self.assertTrue(5000 <= histogram.get_percentile(100) <= 5500)
+    # counts are saved as JSON, with string keys
+    restored = LatencyHistogram({str(k): v for k, v in histogram.counts.items()})
+    self.assertEqual(restored.get_percentile(99), histogram.get_percentile(99))
+
+  def test_decay(self):
+    histogram = web_monitor.LatencyHistogram()
+    for _ in range(1000):
+      histogram.add(100)
+    for _ in range(600):
+      histogram.add(1000)
+    # without halving, 1000 old samples would still hold the median at 100ms
+    self.assertTrue(1000 <= histogram.get_percentile(50) <= 1100)
+    self.assertLessEqual(histogram.total, web_monitor.LatencyHistogram.MAX_COUNT)
+
+class SSLRatingCacheTestCase(unittest.TestCase):
+  def test_expiry_and_fingerprint(self):
+    import tempfile
+    url = 'https://www.example.com/'
+    ratings = [ssl_rating.SSLRecord(url=url, ip='192.0.2.1', grade='A+', report='r1'),
+               ssl_rating.SSLRecord(url=url, ip='192.0.2.2', grade='A', report='r2')]
+    with tempfile.TemporaryDirectory() as work_dir:
+      cache_file = os.path.join(work_dir, 'ssl-rating-cache.json')
+      cache = ssl_rating.SSLRatingCache(cache_file, max_age_hours=1)
+      cache.put(url, 'fp1', ratings)
+      # reloaded from disk, keyed by host and IP
+      cache = ssl_rating.SSLRatingCache(cache_file, max_age_hours=1)
+      self.assertEqual(sorted((r.ip, r.grade) for r in cache.get(url, 'fp1')), [('192.0.2.1', 'A+'), ('192.0.2.2', 'A')])
+      self.assertIsNotNone(cache.get(url), 'unknown fingerprint should not invalidate')
+      # one endpoint expiring is enough to rescan the host
+      cache._hosts['www.example.com']['records']['192.0.2.2']['time'] -= 2 * 3600
+      self.assertIsNone(cache.get(url, 'fp1'))
+      cache.put(url, 'fp1', ratings)
+      # a new certificate is rated again, then both are known (e.g. servers with their own certificates)
+      self.assertIsNone(cache.get(url, 'fp2'))
+      cache.put(url, 'fp2', ratings)
+      self.assertIsNotNone(cache.get(url, 'fp1'))
+      self.assertIsNotNone(cache.get(url, 'fp2'))
+      # entries from before several certificates were kept
+      cache._hosts['www.example.com'] = {'fingerprint': 'fp1', 'records': cache._hosts['www.example.com']['records']}
+      self.assertIsNotNone(cache.get(url, 'fp1'))
+      self.assertIsNone(cache.get(url, 'fp2'))
+      # failed ratings are not cached
+      other_url = 'https://www2.example.com/'
+      cache.put(other_url, 'fp1', [ssl_rating.SSLRecord(url=other_url, grade='Error', error='timeout')])
+      self.assertIsNone(cache.get(other_url, 'fp1'))
+
+class ProbeEngineTestCase(unittest.TestCase):
+  def test_park_and_retry(self):
+    engine = web_monitor.ProbeEngine(workers=4, host_concurrency=1, host_rate=0,
+                                     max_retries=3, retry_base_delay=0.05, retry_max_delay=0.1)
+    # job i fails its first i attempts, so jobs 4 and 5 run out of retries
+    jobs = [(i, f'http://127.0.0.1/{i}') for i in range(6)] + [(0, 'http://127.0.0.2/')]
+    lock = threading.Lock()
+    busy = {}
+    max_busy = {}
+
+    def attempt(result, index, url):
+      host = url.split('/')[2]
+      with lock:
+        busy[host] = busy.get(host, 0) + 1
+        max_busy[host] = max(max_busy.get(host, 0), busy[host])
+      time.sleep(0.01)
+      with lock:
+        busy[host] -= 1
+      result['attempts'] += 1
+      return result
+
+    def probe(index, url):
+      return attempt({'index': index, 'url': url, 'attempts': 0}, index, url)
+
+    results = engine.run(jobs, probe, attempt, lambda result: result['attempts'] <= result['index'])
+    self.assertEqual([result['url'] for result in results], [job[-1] for job in jobs], 'results not in job order')
+    self.assertEqual([result['attempts'] for result in results], [1, 2, 3, 4, 4, 4, 1], 'retries not bounded')
+    self.assertEqual(max_busy, {'127.0.0.1': 1, '127.0.0.2': 1}, 'host concurrency exceeded')
+
 class WebMonitorTestCase(unittest.TestCase):
+  def test_sort_report(self):
+    SiteRecord = web_monitor.SiteRecord
+    report = [SiteRecord(url='a', online=True, ssl_expires=90, ssl_rating='A'),
+              SiteRecord(url='b', online=True, ssl_expires=90, ssl_rating='B'),
+              SiteRecord(url='c', online=False, ssl_expires=90, error='Timeout'),
+              SiteRecord(url='d', online=True, ssl_expires=5, ssl_rating='A'),
+              SiteRecord(url='e', online=True, ssl_expires=90, ssl_rating='B', error='HTTP 500')]
+    WebMonitor._sort_report(report)
+    self.assertEqual([r.url for r in report], ['d', 'c', 'e', 'b', 'a'])
+    summary = WebMonitor._summarize_report(report)
+    self.assertEqual((summary.errors, summary.offline, summary.ssl_expires_30, summary.ssl_expires_later), (2, 1, 1, 4))
+    self.assertAlmostEqual(summary.online_ratio, 0.8)
+
   def test_webmonitor_report(self):
     urls = ['https://www.google.com', 'https://www.google1.com']
     monitor = WebMonitor('src/web-monitor.cfg')  # Assuming a test config exists
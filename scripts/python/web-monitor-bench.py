@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+# Offline benchmark for web-monitor: stand-in sites on loopback addresses, a synthetic
+# xlsx site list, and end to end WebMonitor.check_sites runs measured in a clean process.
+
+import os
+import time
+import json
+import random
+import hashlib
+import resource
+import tempfile
+import subprocess
+import configparser
+import multiprocessing
+import importlib.util
+import http.server
+import ssl
+import threading
+from dataclasses import dataclass, asdict
+import openpyxl
+import common
+logger = common.Logger.getLogger()
+
+@dataclass
+class BenchSettings:
+  urls: int = 1000
+  hosts: int = 50
+  https_ratio: float = 0.5
+  latency: float = 50        # mean server latency (ms)
+  jitter: float = 20         # +/- latency spread (ms)
+  error_rate: float = 0.02   # share of sites answering HTTP 500
+  hang_rate: float = 0.0     # share of sites that hang, then drop the connection
+  hang_time: float = 10      # seconds
+  body_size: int = 4096
+  workers: int = 8
+  host_concurrency: int = 2
+  host_rate: float = 0       # probes per second per host, 0 to disable
+  probe_mode: str = 'full'
+  include_ssl: bool = False
+  seed: int = 1
+  verbose: bool = False
+
+@dataclass
+class BenchResult:
+  urls: int = 0
+  records: int = 0
+  errors: int = 0
+  seconds: float = 0
+  urls_per_second: float = 0
+  p50_ms: int = 0
+  p99_ms: int = 0
+  peak_rss_mb: float = 0
+  cpu_ms_per_url: float = 0
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def _get_outcome(self):
+    # fixed per path, so a failing site keeps failing across retries
+    settings = self.server.settings
+    digest = hashlib.md5(f"{settings.seed}:{self.path}".encode()).digest()
+    draw = int.from_bytes(digest[:4], "big") / 2**32
+    if draw < settings.error_rate:
+      return "error"
+    if draw < settings.error_rate + settings.hang_rate:
+      return "hang"
+    return "ok"
+
+  def _respond(self, send_body):
+    settings = self.server.settings
+    outcome = self._get_outcome()
+    if outcome == "hang":
+      time.sleep(settings.hang_time)
+      self.close_connection = True
+      return
+    delay = settings.latency + random.uniform(-settings.jitter, settings.jitter)
+    time.sleep(max(0, delay) / 1000)
+    body = self.server.body if outcome == "ok" else b"Internal Server Error"
+    self.send_response(200 if outcome == "ok" else 500)
+    self.send_header("Content-Type", "text/html")
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    if send_body:
+      self.wfile.write(body)
+
+  def do_GET(self):
+    self._respond(True)
+
+  def do_HEAD(self):
+    self._respond(False)
+
+  def log_message(self, format, *args):
+    pass
+
+class StandInServer(http.server.ThreadingHTTPServer):
+  daemon_threads = True
+  request_queue_size = 256
+
+  def __init__(self, address, settings, ssl_context=None):
+    self.settings = settings
+    self.ssl_context = ssl_context
+    self.body = (b"<html><body>" + b"x" * settings.body_size + b"</body></html>")
+    super().__init__(address, StandInHandler)
+
+  def finish_request(self, request, client_address):
+    # TLS handshake in the request thread, so one slow client doesn't stall accepting
+    if self.ssl_context:
+      request = self.ssl_context.wrap_socket(request, server_side=True)
+    super().finish_request(request, client_address)
+
+  def handle_error(self, request, client_address):
+    # clients dropping connections early is expected
+    pass
+
+class StandInSites:
+  """Loopback HTTP and HTTPS servers, one pair per stand-in host (127.0.x.y), run in a child process"""
+
+  def __init__(self, settings, work_dir):
+    self._settings = settings
+    self._work_dir = work_dir
+    self._process = None
+    self.http_ports = {}
+    self.https_ports = {}
+    self.ca_file = None
+
+  def get_host(self, index):
+    return f"127.0.{1 + index // 250}.{1 + index % 250}"
+
+  def _create_certificate(self):
+    cert_file = os.path.join(self._work_dir, "stand-in-cert.pem")
+    key_file = os.path.join(self._work_dir, "stand-in-key.pem")
+    sans = ",".join(f"IP:{self.get_host(i)}" for i in range(self._settings.hosts))
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "365",
+                    "-subj", "/CN=web-monitor-bench", "-addext", f"subjectAltName={sans}",
+                    "-keyout", key_file, "-out", cert_file],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+  def _serve(self, ports, ready, key_file):
+    servers = []
+    ssl_context = None
+    if key_file:
+      ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+      ssl_context.load_cert_chain(self.ca_file, key_file)
+    for i in range(self._settings.hosts):
+      host = self.get_host(i)
+      servers.append(StandInServer((host, 0), self._settings))
+      if ssl_context:
+        servers.append(StandInServer((host, 0), self._settings, ssl_context))
+    for server in servers:
+      threading.Thread(target=server.serve_forever, daemon=True).start()
+      scheme = "https" if server.ssl_context else "http"
+      ports[(scheme, server.server_address[0])] = server.server_address[1]
+    ready.set()
+    threading.Event().wait()
+
+  def start(self):
+    key_file = None
+    if self._settings.https_ratio > 0:
+      try:
+        self.ca_file, key_file = self._create_certificate()
+      except Exception as e:
+        logger.warning(f"Cannot create certificate with openssl, HTTPS sites disabled: {e}")
+        self._settings.https_ratio = 0
+    manager = multiprocessing.Manager()
+    ports = manager.dict()
+    ready = manager.Event()
+    self._process = multiprocessing.Process(target=self._serve, args=(ports, ready, key_file), daemon=True)
+    self._process.start()
+    if not ready.wait(60):
+      raise Exception("Stand-in sites did not start")
+    for (scheme, host), port in ports.items():
+      (self.https_ports if scheme == "https" else self.http_ports)[host] = port
+    manager.shutdown()
+    logger.info(f"Stand-in sites ready: {self._settings.hosts} hosts, HTTPS {'on' if self.https_ports else 'off'}")
+
+  def stop(self):
+    if self._process:
+      self._process.terminate()
+      self._process.join()
+      self._process = None
+
+  def get_urls(self, count):
+    rng = random.Random(self._settings.seed)
+    urls = []
+    for i in range(count):
+      host = self.get_host(i % self._settings.hosts)
+      if self.https_ports and rng.random() < self._settings.https_ratio:
+        urls.append(f"https://{host}:{self.https_ports[host]}/site/{i}")
+      else:
+        urls.append(f"http://{host}:{self.http_ports[host]}/site/{i}")
+    return urls
+
+def generate_site_list(urls, filepath, sheet_size=5000):
+  """Write URLs into a workbook laid out like monitored-urls.xlsx"""
+  workbook = openpyxl.Workbook(write_only=True)
+  for start in range(0, len(urls), sheet_size):
+    sheet = workbook.create_sheet(f"Sites {start // sheet_size + 1}")
+    sheet.append(["URL", "Ignore Until", "SSL Report", "Interval", "Probe"])
+    for url in urls[start:start + sheet_size]:
+      sheet.append([url])
+  workbook.save(filepath)
+
+def write_monitor_config(settings, work_dir, site_list):
+  config = configparser.ConfigParser()
+  config["Global"] = {
+    "URLFile": site_list,
+    "CacheDir": work_dir,
+    # keep synthetic reports out of the real archive folder
+    "ArchiveFolder": work_dir,
+    "Workers": str(settings.workers),
+    "HostConcurrency": str(settings.host_concurrency),
+    "HostRate": str(settings.host_rate),
+    "MaxRetries": "0",
+    "ProbeMode": settings.probe_mode,
+  }
+  config["SSL"] = {"GetSSLReport": "yes" if settings.include_ssl else "no", "GenerateSSLRating": "no"}
+  config_file = os.path.join(work_dir, "web-monitor-bench.cfg")
+  with open(config_file, "w") as f:
+    config.write(f)
+  return config_file
+
+def percentile(values, pct):
+  if not values:
+    return 0
+  values = sorted(values)
+  return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def run_monitor(config_file, ca_file, verbose, results):
+  """Child process: one check_sites run, measured with this process' own CPU and peak RSS"""
+  if ca_file:
+    os.environ["REQUESTS_CA_BUNDLE"] = ca_file
+  if not verbose:
+    logger.setLevel("CRITICAL")
+  script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "web-monitor.py")
+  spec = importlib.util.spec_from_file_location("web_monitor", script)
+  web_monitor = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(web_monitor)
+  monitor = web_monitor.WebMonitor(config_file)
+  urls = sum(len(urls) for urls in monitor._URLs_by_sheet.values())
+  usage_start = resource.getrusage(resource.RUSAGE_SELF)
+  t_start = time.perf_counter()
+  report = monitor.check_sites() or []
+  seconds = time.perf_counter() - t_start
+  usage_stop = resource.getrusage(resource.RUSAGE_SELF)
+  cpu = (usage_stop.ru_utime - usage_start.ru_utime) + (usage_stop.ru_stime - usage_start.ru_stime)
+  latencies = [record.response_time for record in report if record.response_time]
+  results.put(asdict(BenchResult(
+    urls=urls,
+    records=len(report),
+    errors=sum(1 for record in report if record.error),
+    seconds=round(seconds, 2),
+    urls_per_second=round(urls / seconds, 1) if seconds else 0,
+    p50_ms=percentile(latencies, 50),
+    p99_ms=percentile(latencies, 99),
+    peak_rss_mb=round(usage_stop.ru_maxrss / 1024, 1),
+    cpu_ms_per_url=round(cpu * 1000 / urls, 2) if urls else 0)))
+
+def benchmark(settings, sizes, output_file=None):
+  results = []
+  with tempfile.TemporaryDirectory(prefix="web-monitor-bench-") as work_dir:
+    sites = StandInSites(settings, work_dir)
+    sites.start()
+    try:
+      for size in sizes:
+        site_list = os.path.join(work_dir, f"sites-{size}.xlsx")
+        generate_site_list(sites.get_urls(size), site_list)
+        config_file = write_monitor_config(settings, work_dir, site_list)
+        logger.info(f"Checking {size} URLs...")
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=run_monitor, args=(config_file, sites.ca_file, settings.verbose, queue))
+        process.start()
+        result = queue.get()
+        process.join()
+        logger.info(f"{result['urls']} URLs in {result['seconds']}s: {result['urls_per_second']} URLs/s, "
+                    f"p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, peak RSS {result['peak_rss_mb']}MB, "
+                    f"CPU {result['cpu_ms_per_url']}ms/URL, {result['errors']} errors")
+        results.append(result)
+    finally:
+      sites.stop()
+  if output_file:
+    with open(output_file, "w") as f:
+      json.dump({"settings": asdict(settings), "results": results}, f, indent=1)
+  return results
+
+def run_benchmark(args):
+  settings = BenchSettings()
+  # every option is optional, defaults come from BenchSettings
+  for field in ("hosts", "workers", "host_concurrency", "body_size", "seed"):
+    if getattr(args, field):
+      setattr(settings, field, int(getattr(args, field)))
+  for field in ("https_ratio", "latency", "jitter", "error_rate", "hang_rate", "hang_time", "host_rate"):
+    if getattr(args, field):
+      setattr(settings, field, float(getattr(args, field)))
+  if args.probe_mode:
+    settings.probe_mode = args.probe_mode
+  settings.include_ssl = bool(args.ssl)
+  settings.verbose = bool(args.verbose)
+  sizes = [int(size) for size in (args.urls or str(settings.urls)).split(",")]
+  benchmark(settings, sizes, args.output)
+
+#################################
+# Program starts
+#################################
+if (__name__ == '__main__') and ('UNIT_TEST' not in os.environ):
+  CLI_config = { 'commands': [
+    {'name':'run', 'help':'Run check_sites against local stand-in sites', 'func':run_benchmark, 'params': [
+      {'name':'--urls', 'help':'Number of URLs, comma separated for several runs (e.g. 1000,10000,100000)'},
+      {'name':'--hosts', 'help':'Number of stand-in hosts (default 50)'},
+      {'name':'--https-ratio', 'help':'Share of HTTPS sites (default 0.5)'},
+      {'name':'--latency', 'help':'Mean server latency in ms (default 50)'},
+      {'name':'--jitter', 'help':'Latency spread in ms (default 20)'},
+      {'name':'--error-rate', 'help':'Share of sites answering HTTP 500 (default 0.02)'},
+      {'name':'--hang-rate', 'help':'Share of sites that hang and drop the connection (default 0)'},
+      {'name':'--hang-time', 'help':'Seconds a hanging site waits (default 10)'},
+      {'name':'--body-size', 'help':'Page size in bytes (default 4096)'},
+      {'name':'--workers', 'help':'Monitor workers (default 8)'},
+      {'name':'--host-concurrency', 'help':'Monitor per-host concurrency (default 2)'},
+      {'name':'--host-rate', 'help':'Monitor per-host probes per second (default 0, unlimited)'},
+      {'name':'--probe-mode', 'help':'full, head or stream (default full)'},
+      {'name':'--seed', 'help':'Random seed (default 1)'},
+      {'name':'--output', 'help':'Write results as JSON'},
+      {'name':'--ssl', 'help':'Include SSL expiration check', 'action':'store_true'},
+      {'name':'--verbose', 'help':'Keep monitor debug logging', 'action':'store_true'},
+      ]}
+    ]}
+  common.CLIParser.run(CLI_config)
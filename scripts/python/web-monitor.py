@@ -3,20 +3,17 @@
 import os, sys
 import json
 import time, datetime
+import random
+import math
 import dateutil.parser as parser
 # for struct-like class
 import copy
 import dataclasses
 # for web APIs
 import socket, ipaddress
-import requests
 import urllib.parse
-# for reporting
-import jinja2 # HTML report
-import openpyxl # Excel operations
-import openpyxl.styles # Excel formatting
+# for reporting (template_util, openpyxl and influxdb are heavy, imported where used)
 import io
-import influxdb # InfluxDB history
 # for email
 import email_util
 # for SSL rating
@@ -24,34 +21,107 @@ import ssl_rating
 # for web utilities
 import web_util
 # for Azure DNS glitch (use custom DNS to confirm)
-import dns.resolver
-dns.resolver.default_resolver = dns.resolver.Resolver(configure=False)
-dns.resolver.default_resolver.nameservers = ["9.9.9.9"]
+web_util.configure_dns_cache(nameservers=["9.9.9.9"])
 # for logging and CLI arguments parsing
 import configparser
 import common
 import threading
+# for concurrent probing
+import asyncio
+import concurrent.futures
+# for daemon mode
+import heapq
+import itertools
 logger = common.Logger.getLogger()
 common.Logger.disable_http_tracing()
 
 # some constants to handle special error conditions
 POSSIBLE_DNS_GLITCH = "Name or service not known"
+# bump when the cached site list format changes
+SITE_LIST_CACHE_VERSION = 2
 # add header for identity
 APP_ID = "3ec1184c-03cd-4d44-b82a-0c6b14982201"
 
 # Some times requests or socket get 'Name or service not known' incorrectly, can use a different DNS server to confirm
 
-@dataclasses.dataclass
+# slots keep large reports compact and attribute access fast
+@dataclasses.dataclass(slots=True)
 class SiteRecord:
   url: str
   alive: bool = False
   online: bool = False
   response_time: int = 0
+  # breakdown of response_time (ms)
+  dns_time: int = 0
+  connect_time: int = 0
+  tls_time: int = 0
+  ttfb_time: int = 0
+  body_time: int = 0
   ip: str = ''
   error: str = ''
   ssl_expires: str = ''
   ssl_rating: str = ''
   ssl_report: str = ''
+  # seconds the SSL rating waited for and spent in a local scan (0 if cached or from SSL Labs)
+  ssl_queue_time: float = 0.0
+  ssl_scan_time: float = 0.0
+  # certificate seen by the status check
+  ssl_not_after: datetime.datetime = None
+  ssl_issuer: str = ''
+  ssl_sans: str = ''
+  ssl_fingerprint: str = ''
+  # location of ip, filled in for reports
+  city: str = None
+  region: str = None
+  country: str = None
+
+@dataclasses.dataclass
+class ReportSummary:
+  total: int = 0
+  errors: int = 0
+  offline: int = 0
+  online_ratio: float = 0.0
+  # SSL certificates by days left (unknown: no certificate seen)
+  ssl_expired: int = 0
+  ssl_expires_30: int = 0
+  ssl_expires_60: int = 0
+  ssl_expires_later: int = 0
+  ssl_unknown: int = 0
+
+@dataclasses.dataclass
+class ProbeOptions:
+  # full: read whole body, head: HEAD request,
+  # stream: GET and close after headers, or after max_bytes when looking for keywords
+  mode: str = 'full'
+  max_bytes: int = 65536
+  # text the page must contain to count as online (read within max_bytes unless in full mode)
+  keyword: str = ''
+  # request timeout (seconds) and slow response alert threshold (ms), adapted per site from its history
+  timeout: float = 120
+  slow_threshold: int = 10000
+
+PROBE_MODES = ('full', 'head', 'stream')
+
+class KeywordScanner:
+  """Find keywords in a body fed chunk by chunk, without keeping the body"""
+
+  def __init__(self, keywords):
+    self._pending = {keyword.lower().encode(): keyword for keyword in keywords if keyword}
+    # keep enough of the previous chunk to match keywords across chunk boundaries
+    self._overlap = max((len(key) for key in self._pending), default=1) - 1
+    self._tail = b''
+    self.found = set()
+
+  def is_done(self):
+    return not self._pending
+
+  def feed(self, chunk):
+    if not self._pending:
+      return
+    data = self._tail + chunk.lower()
+    for key in [key for key in self._pending if key in data]:
+      self.found.add(self._pending.pop(key))
+    self._tail = data[-self._overlap:] if self._overlap else b''
 
 class SiteInfo:
   def is_valid_url(url):
@@ -63,34 +133,86 @@ class SiteInfo:
     else:
       return False
 
-  def get_status(url, allow_retry=True):
+  def _read_body(r, max_bytes, scanner, stop_when_found):
+    """Read body in chunks up to max_bytes (None: all), feeding the keyword scanner, returns bytes read"""
+    read = 0
+    if max_bytes == 0 or (stop_when_found and scanner.is_done()):
+      return read
+    for chunk in r.iter_content(chunk_size=16384):
+      scanner.feed(chunk)
+      read += len(chunk)
+      if max_bytes is not None and read >= max_bytes:
+        break
+      if stop_when_found and scanner.is_done():
+        break
+    return read
+
+  def get_status(url, allow_retry=True, probe=None):
     status = SiteRecord(url=url)
+    probe = probe or ProbeOptions()
     # return alive (if reachable), online (if functional) and error if any
     # by default alive and online status will be False unless explicitly set to True
+    if not web_util.circuit_allows(url):
+      # host refused or black-holed recent connects, don't hold a worker for the full timeout
+      status.error = f"CircuitOpen: skipped after {web_util.CircuitBreaker.get_failures(url)} consecutive connect failures"
+      logger.error(f"{url} failed: {status.error}")
+      return status
     try:
       #logger.debug(f"Checking [{url}] status...")
-      time.sleep(1)
       t_start = time.perf_counter_ns()
       headers = {
         "Accept-Language": "en-US,en;q=0.5",
         "User-Agent": web_util.get_user_agent(),
         "App-Id": APP_ID
       }
-      r = requests.get(url, headers=headers, timeout=120)
+      session = web_util.get_http_session()
+      # keywords can't be found without a body
+      mode = 'stream' if probe.mode == 'head' and probe.keyword else probe.mode
+      if mode == 'head':
+        r = session.head(url, headers=headers, timeout=probe.timeout, allow_redirects=True, stream=True)
+        if r.status_code >= 400 and r.status_code != 401:
+          # HEAD is often rejected, and error pages may tell about maintenance
+          r.close()
+          mode = 'stream'
+      if mode != 'head':
+        # stream so that headers and body arrival can be timed separately
+        r = session.get(url, headers=headers, timeout=probe.timeout, stream=True)
+      t_headers = time.perf_counter_ns()
+      web_util.record_circuit_success(url)
+      timings = web_util.get_phase_timings(r)
+      SiteInfo._set_peer_info(status, r)
+      is_ok = (r.status_code < 400) or (r.status_code == 401)
+      if is_ok:
+        scanner = KeywordScanner([probe.keyword])
+      else:
+        scanner = KeywordScanner(["maintenance"])
+      if mode != 'head':
+        # full mode reads the whole body, stream mode stops at the budget or once keywords are found
+        max_bytes = None if mode == 'full' else probe.max_bytes
+        SiteInfo._read_body(r, max_bytes, scanner, stop_when_found=(mode == 'stream'))
       r.close()
       t_stop = time.perf_counter_ns()
       t_elapsed_ms = int((t_stop - t_start) / 1000000)
       status.response_time = t_elapsed_ms
-      if (r.status_code < 400) or (r.status_code == 401):
+      status.dns_time = timings["dns"]
+      status.connect_time = timings["connect"]
+      status.tls_time = timings["tls"]
+      status.ttfb_time = max(0, int((t_headers - t_start) / 1000000) - sum(timings.values()))
+      status.body_time = int((t_stop - t_headers) / 1000000)
+      if is_ok and not scanner.is_done():
+        status.error = f"Keyword not found: {probe.keyword}"
+        logger.error(f"{url} failed: {status.error}")
+        status.alive = True
+      elif is_ok:
         logger.debug(f"Online (status={r.status_code}, time={t_elapsed_ms}ms)")
-        if (t_elapsed_ms > 10000):
-          logger.error(f"{url} response time too long: {t_elapsed_ms}ms")
+        if (t_elapsed_ms > probe.slow_threshold):
+          logger.error(f"{url} response time too long: {t_elapsed_ms}ms (threshold {probe.slow_threshold}ms)")
         status.alive = True
         status.online = True
-      elif "maintenance" in r.text:
+      elif scanner.is_done():
         status.alive = True
         status.online = True
-        logger.info(f"{url} is under maintenance: {r.text}")
+        logger.info(f"{url} is under maintenance (status={r.status_code})")
       else:
         status.error = f"HTTP error code: {r.status_code}"
         logger.error(f"{url} failed: {status.error}")
@@ -99,11 +221,14 @@ class SiteInfo:
     except Exception as e:
       error_type = type(e).__name__
       error_msg = f"{e}"
+      if web_util.is_connect_failure(e):
+        web_util.record_circuit_failure(url)
       if (POSSIBLE_DNS_GLITCH in error_msg):
         if allow_retry:
-          # retry once for DNS error
+          # retry once for DNS error, without the cached failure
           time.sleep(15)
-          return SiteInfo.get_status(url, False)
+          web_util.flush_dns_cache(urllib.parse.urlparse(url).hostname)
+          return SiteInfo.get_status(url, False, probe)
         logger.error(f"{url} DNS error: {POSSIBLE_DNS_GLITCH}")
         # retry still failed, try to ping IP directly (this may not be accurate for sites using reverse proxy)
         if web_util.is_host_reachable(url):
@@ -118,14 +243,34 @@ class SiteInfo:
         status.alive = True
       return status
 
-  def is_blocked(url):
+  def _set_peer_info(status, r):
+    peer_ip, peer_cert = web_util.get_peer_info(r)
+    if peer_ip:
+      status.ip = peer_ip
+    # only trust the certificate if it belongs to the checked site (not a redirect target)
+    requested = urllib.parse.urlparse(status.url)
+    final = urllib.parse.urlparse(r.url)
+    if peer_cert and final.scheme == 'https' and \
+       (final.hostname, final.port) == (requested.hostname, requested.port):
+      status.ssl_not_after = peer_cert["expires"]
+      status.ssl_issuer = peer_cert["issuer"]
+      status.ssl_sans = ", ".join(peer_cert["sans"])
+      status.ssl_fingerprint = peer_cert["fingerprint"]
+
+  def _get_ssl_expiration(site_info, ip=None):
+    """Use certificate from the status check if possible, otherwise do a separate handshake"""
+    if site_info.ssl_not_after and (not ip or ip == site_info.ip):
+      return ssl_rating.SSLReport.get_ssl_expiration_record(site_info.url, ip, site_info.ssl_not_after)
+    return ssl_rating.SSLReport.get_ssl_expires_in_days(site_info.url, ip, get_ip_addresses_func=web_util.get_ip_addresses, is_host_reachable_func=web_util.is_host_reachable)[0]
+
+  def is_blocked(url, timeout=(5, 10)):
     try:
-      time.sleep(1)
       headers = {
         "Accept-Language": "en-US,en;q=0.5",
         "User-Agent": web_util.get_user_agent()
       }
-      r = requests.get(url, headers=headers)
+      # short (connect, read) budget: a blocked URL is usually black-holed, not refused
+      r = web_util.get_http_session().get(url, headers=headers, timeout=timeout, stream=True)
       r.close()
       if r.status_code < 400:
         logger.error(f"Online (status={r.status_code}) --> Unexpected!")
@@ -137,28 +282,29 @@ class SiteInfo:
       logger.debug(f"Network error: {e} --> Expected")
       return True
 
-  def get_report(url, include_ssl_rating=False):
+  def get_status_report(url, include_ssl_rating=False, probe=None):
+    """Status with basic SSL info, returns (site_info, True if a full SSL report is wanted)"""
     url = url.strip(' \r\'\"\n').lower()
-    site_info = SiteInfo.get_status(url)
+    site_info = SiteInfo.get_status(url, probe=probe)
     if not site_info.alive \
        or url.startswith('http://') \
        or not include_ssl_rating:
       # no point to continue if not alive, or it's HTTP, or no need for SSL info
-      return [site_info]
+      return site_info, False
     # basic SSL info
-    ssl_expiration_info = ssl_rating.SSLReport.get_ssl_expires_in_days(url, get_ip_addresses_func=web_util.get_ip_addresses, is_host_reachable_func=web_util.is_host_reachable)[0]
+    ssl_expiration_info = SiteInfo._get_ssl_expiration(site_info)
     site_info.ssl_expires = ssl_expiration_info.expires
     if ssl_expiration_info.error:
       site_info.error = ssl_expiration_info.error
-    if not ssl_rating.SSLReport.should_get_rating():
-      return [site_info]
-    # get full SSL report
+    return site_info, ssl_rating.SSLReport.should_get_rating()
+
+  def add_ssl_ratings(site_info, ssl_rating_info):
+    """One report per endpoint rated by the SSL scanner, based on the site's status"""
     final_reports = []
-    ssl_rating_info = ssl_rating.SSLReport.get_site_rating(url)
     for record in ssl_rating_info:
       report = copy.copy(site_info)
-      report.ip = record.ip
-      ssl_expiration_info = ssl_rating.SSLReport.get_ssl_expires_in_days(url, record.ip, get_ip_addresses_func=web_util.get_ip_addresses, is_host_reachable_func=web_util.is_host_reachable)[0]
+      report.ip = record.ip if record.ip else site_info.ip
+      ssl_expiration_info = SiteInfo._get_ssl_expiration(site_info, record.ip)
       report.ssl_expires = ssl_expiration_info.expires
       if ssl_expiration_info.error:
         report.error = ssl_expiration_info.error
@@ -171,9 +317,189 @@ class SiteInfo:
         report.error = record.error
       if record.report:
         report.ssl_report = record.report
+      report.ssl_queue_time = record.queue_time
+      report.ssl_scan_time = record.scan_time
       final_reports.append(report)
     return final_reports
 
+  def get_report(url, include_ssl_rating=False, probe=None):
+    site_info, get_rating = SiteInfo.get_status_report(url, include_ssl_rating, probe)
+    if not get_rating:
+      return [site_info]
+    # get full SSL report
+    return SiteInfo.add_ssl_ratings(site_info, ssl_rating.SSLReport.get_site_rating(site_info.url, site_info.ssl_fingerprint))
+
+class LatencyHistogram:
+  """Log-bucketed latency histogram (about 9% resolution), decayed so it follows a site's recent behaviour"""
+
+  BUCKETS_PER_OCTAVE = 8
+  MAX_COUNT = 1000  # counts are halved beyond this, so old samples fade out
+
+  def __init__(self, counts=None):
+    self.counts = {int(k): v for k, v in (counts or {}).items()}
+    self.total = sum(self.counts.values())
+
+  def add(self, ms):
+    bucket = int(math.log2(max(1, ms)) * self.BUCKETS_PER_OCTAVE)
+    self.counts[bucket] = self.counts.get(bucket, 0) + 1
+    self.total += 1
+    if self.total > self.MAX_COUNT:
+      self.counts = {k: v / 2 for k, v in self.counts.items() if v >= 1}
+      self.total = sum(self.counts.values())
+
+  def get_percentile(self, pct):
+    """Upper bound (ms) of the bucket holding the percentile"""
+    if not self.total:
+      return None
+    rank = pct / 100 * self.total
+    seen = 0
+    for bucket in sorted(self.counts):
+      seen += self.counts[bucket]
+      if seen >= rank:
+        return int(2 ** ((bucket + 1) / self.BUCKETS_PER_OCTAVE))
+    return int(2 ** ((max(self.counts) + 1) / self.BUCKETS_PER_OCTAVE))
+
+class LatencyModel:
+  """Per-site latency histograms persisted between runs, giving timeouts and slow thresholds from p99"""
+
+  def __init__(self, history_file, min_samples=20, timeout_factor=4, min_timeout=10, max_timeout=120,
+               slow_factor=2, min_slow_threshold=2000):
+    self._history_file = history_file
+    self._min_samples = min_samples
+    self._timeout_factor = timeout_factor
+    self._min_timeout = min_timeout
+    self._max_timeout = max_timeout
+    self._slow_factor = slow_factor
+    self._min_slow_threshold = min_slow_threshold
+    self._lock = threading.Lock()
+    self._sites = {}
+    try:
+      if os.path.isfile(history_file):
+        with open(history_file, "r") as f:
+          self._sites = {url: LatencyHistogram(counts) for url, counts in json.load(f).items()}
+        logger.debug(f"Latency history loaded: {len(self._sites)} sites.")
+    except Exception as e:
+      logger.warning(f"Ignoring latency history [{history_file}]: {e}")
+
+  def save(self):
+    with self._lock:
+      data = {url: histogram.counts for url, histogram in self._sites.items()}
+    try:
+      web_util.save_json(self._history_file, data)
+    except Exception as e:
+      logger.warning(f"Failed to save latency history [{self._history_file}]: {e}")
+
+  def record(self, url, ms):
+    with self._lock:
+      self._sites.setdefault(url, LatencyHistogram()).add(ms)
+
+  def get_p99(self, url):
+    """p99 latency (ms) of the site, None until there are enough samples"""
+    with self._lock:
+      histogram = self._sites.get(url)
+      if not histogram or histogram.total < self._min_samples:
+        return None
+      return histogram.get_percentile(99)
+
+  def adapt(self, url, options):
+    """Probe options with timeout and slow threshold derived from the site's p99"""
+    p99 = self.get_p99(url)
+    if p99 is None:
+      return options
+    timeout = min(self._max_timeout, max(self._min_timeout, p99 * self._timeout_factor / 1000))
+    slow_threshold = min(int(timeout * 1000), max(self._min_slow_threshold, p99 * self._slow_factor))
+    return dataclasses.replace(options, timeout=timeout, slow_threshold=slow_threshold)
+
+class ProbeEngine:
+  """Run blocking site probes from a shared queue served by a fixed pool of asyncio workers"""
+
+  def __init__(self, workers=8, host_concurrency=2, host_rate=1.0,
+               max_retries=0, retry_base_delay=15, retry_max_delay=120):
+    self._workers = max(1, workers)
+    self._host_concurrency = max(1, host_concurrency)
+    self._host_rate = host_rate
+    self._max_retries = max_retries
+    self._retry_base_delay = retry_base_delay
+    self._retry_max_delay = retry_max_delay
+    # token buckets outlive a single run so retries stay polite too
+    self._host_buckets = {}
+
+  def _get_bucket(self, host):
+    bucket = self._host_buckets.get(host)
+    if not bucket:
+      bucket = self._host_buckets.setdefault(host, web_util.TokenBucket(self._host_rate))
+    return bucket
+
+  def _get_retry_delay(self, attempt):
+    # exponential backoff with jitter, so flapping sites don't retry in lockstep
+    delay = min(self._retry_max_delay, self._retry_base_delay * (2 ** (attempt - 1)))
+    return delay * random.uniform(0.5, 1.0)
+
+  async def _run(self, jobs, probe_func, retry_func, should_retry):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    for index, job in enumerate(jobs):
+      queue.put_nowait((index, job, 0))
+    results = [None] * len(jobs)
+    # jobs for a host already at its limit are parked instead of blocking a worker,
+    # and go back to the queue when one of that host's probes finishes
+    host_busy = {}
+    parked = {}
+
+    def requeue(item):
+      # put the retry before completing the failed attempt, so the queue never looks finished
+      queue.put_nowait(item)
+      queue.task_done()
+
+    async def worker(executor):
+      while True:
+        index, job, attempt = item = await queue.get()
+        host = urllib.parse.urlparse(job[-1]).netloc
+        if host_busy.get(host, 0) >= self._host_concurrency:
+          parked.setdefault(host, []).append(item)
+          queue.task_done()
+          continue
+        host_busy[host] = host_busy.get(host, 0) + 1
+        retry_delay = None
+        try:
+          delay = self._get_bucket(host).reserve()
+          if delay > 0:
+            await asyncio.sleep(delay)
+          if attempt == 0:
+            results[index] = await loop.run_in_executor(executor, probe_func, *job)
+          else:
+            results[index] = await loop.run_in_executor(executor, retry_func, results[index], *job)
+          if retry_func and should_retry(results[index]) and attempt < self._max_retries:
+            retry_delay = self._get_retry_delay(attempt + 1)
+            logger.info(f"Retry (#{attempt + 1}) {job[-1]} in {retry_delay:.1f}s.")
+        except Exception as e:
+          results[index] = e
+        finally:
+          host_busy[host] -= 1
+          if parked.get(host):
+            queue.put_nowait(parked[host].pop(0))
+          if retry_delay is None:
+            queue.task_done()
+          else:
+            loop.call_later(retry_delay, requeue, (index, job, attempt + 1))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+      workers = [asyncio.create_task(worker(executor)) for _ in range(min(self._workers, len(jobs)))]
+      await queue.join()
+      for task in workers:
+        task.cancel()
+      await asyncio.gather(*workers, return_exceptions=True)
+    return results
+
+  def run(self, jobs, probe_func, retry_func=None, should_retry=None):
+    """Call probe_func(*job) for every job (URL as last item), results (or exceptions) in job order
+
+    If should_retry(result) is true, retry_func(result, *job) is scheduled with backoff
+    (while other jobs go on) until it isn't or retries are used up."""
+    if not jobs:
+      return []
+    return asyncio.run(self._run(jobs, probe_func, retry_func, should_retry))
+
 @dataclasses.dataclass
 class WebHookConfig:
   endpoint: str = None
@@ -195,7 +521,7 @@ class EmailConfig:
   body_template: str = ""
   include_attachment: bool = False
 
-# to start simple, this utility just do one-pass checking (no internal scheduler)
+# one-pass checking by default (check_sites), or resident with per-URL intervals (serve)
 class WebMonitor:
   #########################################
   # Internal helper functions
@@ -212,66 +538,175 @@ class WebMonitor:
       logger.error(f"Failed to parse maintenance time [{time}]: {e}")
       return False
 
-  def _load_urls_from_xlsx(self, filepath):
+  def _parse_maintenance_time(self, value, url):
+    """Maintenance end time as ISO string (None if not set or invalid), so cached lists skip dateutil"""
+    if not value:
+      return None
+    try:
+      if type(value) is not datetime.datetime:
+        value = parser.parse(str(value))
+      return value.isoformat()
+    except Exception as e:
+      logger.error(f"Failed to parse maintenance time [{value}] for {url}: {e}")
+      return None
+
+  def _parse_urls_from_xlsx(self, filepath):
+    """Parse workbook rows into {sheet: [[url, maintenance until, SSL grade wanted, interval, probe mode, keyword]]}"""
+    import openpyxl  # only needed when the cached site list is stale
+    parsed_by_sheet = {}
+    workbook = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
     try:
-      urls_by_sheet = {}
-      workbook = openpyxl.load_workbook(filepath)
       for sheet in workbook.worksheets:
-        url_count = 0
-        urls_in_sheet = []
-        for row in sheet.rows:
-          line = row[0].value
+        entries = []
+        for row in sheet.iter_rows(values_only=True):
+          line = row[0] if row else None
           if not line:
             break
-          line = line.lower().strip(' \r\'\"\n')
-          if line.startswith(("http://", "https://")):
-            # also check if there is a maintenance
-            ignore_until = row[1].value
-            if ignore_until and self.is_future_time(ignore_until):
-              logger.debug(f"{line} is under maintenance until {ignore_until}")
-              continue
-            if self._include_SSL_grade and len(row) > 2:
-              # check if SSL report is required for the URL
-              include_ssl_grade = row[2].value
-              if include_ssl_grade is None or ("yes" not in include_ssl_grade.lower()):
-                continue
-            urls_in_sheet.append(line)
-            url_count += 1
+          line = str(line).lower().strip(' \r\'\"\n')
+          if not line.startswith(("http://", "https://")):
+            continue
+          ignore_until = self._parse_maintenance_time(row[1] if len(row) > 1 else None, line)
+          # None when the sheet has no SSL column, so every URL is included
+          include_ssl_grade = None
+          if len(row) > 2:
+            include_ssl_grade = row[2] is not None and "yes" in str(row[2]).lower()
+          interval = self._get_interval_cell(row[3]) if len(row) > 3 and row[3] else None
+          probe_mode = str(row[4]).strip() if len(row) > 4 and row[4] else None
+          keyword = str(row[5]).strip() if len(row) > 5 and row[5] else None
+          entries.append([line, ignore_until, include_ssl_grade, interval, probe_mode, keyword])
+        parsed_by_sheet[sheet.title] = entries
+    finally:
+      workbook.close()
+    return parsed_by_sheet
+
+  @staticmethod
+  def _get_interval_cell(value):
+    """Interval cell as minutes, or as text if it isn't a number (parsed results are cached as JSON)"""
+    if isinstance(value, (int, float)):
+      return value
+    if isinstance(value, datetime.time):
+      # "0:30" typed into a cell becomes a time of day
+      return value.hour * 60 + value.minute + value.second / 60
+    return str(value).strip()
+
+  def _parse_urls_from_txt(self, filepath):
+    urls = {}  # ordered, for constant time de-duplication
+    with open(filepath, 'r') as f:
+      for line in f:
+        line = line.strip(' \r\'\"\n')
+        if line:
+          urls[line] = None
+    return list(urls)
+
+  def _load_parsed_site_list(self, filepath, parse_func):
+    """Parse site list file, or reuse the cached result if the file has the same mtime and size"""
+    cache_file = os.path.join(self._cache_dir, "site-list-cache.json")
+    stat = os.stat(filepath)
+    key = os.path.abspath(filepath)
+    cache = {}
+    try:
+      if os.path.isfile(cache_file):
+        with open(cache_file, "r") as f:
+          cache = json.load(f)
+        entry = cache.get(key)
+        if entry and entry.get("version") == SITE_LIST_CACHE_VERSION \
+           and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+          logger.debug(f"Site list loaded from cache [{cache_file}]")
+          return entry["parsed"]
+    except Exception as e:
+      logger.warning(f"Ignoring site list cache [{cache_file}]: {e}")
+      cache = {}
+    parsed = parse_func(filepath)
+    try:
+      cache[key] = {"version": SITE_LIST_CACHE_VERSION, "mtime": stat.st_mtime, "size": stat.st_size, "parsed": parsed}
+      web_util.save_json(cache_file, cache)
+    except Exception as e:
+      logger.warning(f"Failed to save site list cache [{cache_file}]: {e}")
+    return parsed
+
+  def _load_urls_from_xlsx(self, filepath):
+    try:
+      urls_by_sheet = {}
+      parsed_by_sheet = self._load_parsed_site_list(filepath, self._parse_urls_from_xlsx)
+      for sheet_title, entries in parsed_by_sheet.items():
+        urls_in_sheet = []
+        for line, ignore_until, include_ssl_grade, interval, probe_mode, keyword in entries:
+          # also check if there is a maintenance
+          if ignore_until and self.is_future_time(datetime.datetime.fromisoformat(ignore_until)):
+            logger.debug(f"{line} is under maintenance until {ignore_until}")
+            continue
+          # check if SSL report is required for the URL
+          if self._include_SSL_grade and include_ssl_grade is False:
+            continue
+          if interval:
+            # optional check interval (minutes) for daemon mode
+            self._URL_intervals[line] = self._parse_interval(interval, line)
+          if probe_mode or keyword:
+            # optional probe mode (xlsx column E, e.g. "stream 16384") and required keyword (column F)
+            self._URL_probes[line] = self._parse_probe_options(probe_mode, keyword, line)
+          urls_in_sheet.append(line)
         # Excel only logic: if there are URLs in 'Internal' tab, record them separately
-        if sheet.title == 'Internal':
-          logger.debug(f"Found {url_count} INTERNAL URLs")
+        if sheet_title == 'Internal':
+          logger.debug(f"Found {len(urls_in_sheet)} INTERNAL URLs")
           self._URLS_BLOCKED = urls_in_sheet
         else:
-          logger.debug(f"Sheet [{sheet.title}]: found {url_count} URLs")
-          urls_by_sheet[sheet.title] = urls_in_sheet
-      workbook.close()
+          logger.debug(f"Sheet [{sheet_title}]: found {len(urls_in_sheet)} URLs")
+          urls_by_sheet[sheet_title] = urls_in_sheet
       return urls_by_sheet
     except Exception as e:
-      logger.critical(f"Cannot load site list file [{filepath}]: {e}")
-      sys.exit(1)
+      raise Exception(f"Cannot load site list file [{filepath}]: {e}") from e
 
   def _load_urls_from_txt(self, filepath):
     try:
-      urls = []
-      with open(filepath, 'r') as f:
-        lines = f.readlines()
-        for line in lines:
-          line = line.strip(' \r\'\"\n')
-          if not line:
-            continue
-          if line not in urls:
-            urls.append(line)
-      return urls
+      return self._load_parsed_site_list(filepath, self._parse_urls_from_txt)
     except Exception as e:
-      logger.critical(f"Cannot load site list file [{filepath}]: {e}")
-      sys.exit(1)
+      raise Exception(f"Cannot load site list file [{filepath}]: {e}") from e
+
+  def _parse_interval(self, value, name):
+    try:
+      return max(1, float(value)) * 60
+    except Exception as e:
+      logger.error(f"Invalid check interval [{value}] for {name}: {e}")
+      return self._check_interval
+
+  def _parse_probe_options(self, value, keyword, name):
+    """Probe options from "<mode> [max bytes]", defaults from the config for anything not given"""
+    options = dataclasses.replace(self._probe_options, keyword=keyword or '')
+    try:
+      if value:
+        parts = value.lower().split()
+        if parts[0] not in PROBE_MODES:
+          raise ValueError(f"mode must be one of {', '.join(PROBE_MODES)}")
+        options.mode = parts[0]
+        if len(parts) > 1:
+          options.max_bytes = max(0, int(parts[1]))
+    except Exception as e:
+      logger.error(f"Invalid probe mode [{value}] for {name}: {e}")
+    return options
+
+  def _get_probe_options(self, url):
+    return self._latency_model.adapt(url, self._URL_probes.get(url, self._probe_options))
 
   def _load_urls(self, filepath):
-    if filepath.lower().endswith('.xlsx'):
-      return self._load_urls_from_xlsx(filepath)
-    else:
-      # For txt, treat as a single "Default" sheet
-      return {"Default": self._load_urls_from_txt(filepath)}
+    """Load site list, raises on errors (keeping the per-URL settings of the previous list)"""
+    previous = (getattr(self, '_URL_intervals', {}), getattr(self, '_URL_probes', {}), getattr(self, '_URLS_BLOCKED', None))
+    self._URL_intervals = {}
+    self._URL_probes = {}
+    if '_URLS_BLOCKED' in dir(self):
+      del self._URLS_BLOCKED
+    try:
+      if filepath.lower().endswith('.xlsx'):
+        return self._load_urls_from_xlsx(filepath)
+      else:
+        # For txt, treat as a single "Default" sheet
+        return {"Default": self._load_urls_from_txt(filepath)}
+    except Exception:
+      self._URL_intervals, self._URL_probes = previous[:2]
+      if previous[2] is not None:
+        self._URLS_BLOCKED = previous[2]
+      elif '_URLS_BLOCKED' in dir(self):
+        del self._URLS_BLOCKED
+      raise
 
   def _load_email_config(self, config, section):
     try:
@@ -336,6 +771,16 @@ class WebMonitor:
         config_dict["local_scanner"] = sslscannerconfig.get("LocalScanner", "").strip('\" ')
         config_dict["openssl_path"] = sslscannerconfig.get("OpenSSLPath", "").strip('\" ')
         config_dict["show_progress"] = sslscannerconfig.getboolean("ShowProgress", fallback=False)
+        # number of testssl.sh scans running at once, and seconds between scans of one host
+        config_dict["max_scans"] = sslscannerconfig.getint("MaxScans", fallback=2)
+        config_dict["scan_interval"] = sslscannerconfig.getint("ScanInterval", fallback=15)
+
+      # ratings are reused for this many hours unless the certificate changes (0 = always rescan)
+      config_dict["cache_max_age"] = sslscannerconfig.getint("RatingCacheMaxAge", fallback=0)
+      cache_file = sslscannerconfig.get("RatingCacheFile", "ssl-rating-cache.json").strip('\" ')
+      if cache_file == os.path.basename(cache_file):
+        cache_file = os.path.join(self._cache_dir, cache_file)
+      config_dict["cache_file"] = cache_file
 
       return ssl_rating.create_ssl_config(config_dict)
     except Exception as e:
@@ -343,174 +788,215 @@ class WebMonitor:
       raise
 
   def _get_report(self, urls, include_ssl_rating=False, sheet_name=None):
-    # unchanged, but now only processes a list of URLs
-    full_report = []
-    has_down_sites = False
-    total = len(urls)
-    i = 1
-    for url in urls:
-      if '://' not in url:
-        # assume https
-        url = f"https://{url}"
-      if not SiteInfo.is_valid_url(url):
-        logger.warning(f"Skipping invalid URL: {url}")
-        continue
-      tab_info = f"[{sheet_name}] " if sheet_name else ""
-      logger.debug(f"Analyzing site {tab_info}({i}/{total}): {url}")
-      result = SiteInfo.get_report(url, include_ssl_rating)
-      i += 1
-      if not result[0].online:
-        has_down_sites = True
-      for record in result:
-        full_report.append(record)
-    return full_report, has_down_sites
+    return self._get_report_multithreaded({sheet_name: urls}, include_ssl_rating)
 
-  def _get_report_multithreaded(self, urls_by_sheet, include_ssl_rating=False):
-    threads = []
-    results = {}
-    errors = {}
+  @staticmethod
+  def _get_job_url(url):
+    if '://' not in url:
+      # assume https
+      url = f"https://{url}"
+    return url
 
-    def worker(sheet, urls):
-      try:
-        report, has_down = self._get_report(urls, include_ssl_rating, sheet_name=sheet)
-        results[sheet] = report
-        errors[sheet] = has_down
-      except Exception as e:
-        logger.error(f"Thread for sheet {sheet} failed: {e}")
-        results[sheet] = []
-        errors[sheet] = False
+  def _get_report_multithreaded(self, urls_by_sheet, include_ssl_rating=False, records_by_url=None):
+    """Check sites of all sheets, returns (report, has_down_sites)
 
+    records_by_url, if given, gets the records of each (sheet, URL) checked."""
+    jobs = []
     for sheet, urls in urls_by_sheet.items():
-      t = threading.Thread(target=worker, args=(sheet, urls))
-      t.start()
-      threads.append(t)
+      total = len(urls)
+      for url in urls:
+        url = self._get_job_url(url)
+        if not SiteInfo.is_valid_url(url):
+          logger.warning(f"Skipping invalid URL: {url}")
+          continue
+        jobs.append((sheet, total, url))
 
-    for t in threads:
-      t.join()
+    # workers pick URLs from any sheet, so count progress per sheet as probes start
+    progress = {sheet: 0 for sheet in urls_by_sheet}
+    progress_lock = threading.Lock()
+    # SSL ratings run in the scanner's own queue, and are collected after the status pass
+    ratings = {}
 
-    # Combine all reports and error flags
-    full_report = []
-    has_down_sites = False
-    for sheet in urls_by_sheet:
-      full_report.extend(results.get(sheet, []))
-      if errors.get(sheet, False):
-        has_down_sites = True
-    return full_report, has_down_sites
+    def probe(sheet, total, url):
+      with progress_lock:
+        progress[sheet] += 1
+        i = progress[sheet]
+      tab_info = f"[{sheet}] " if sheet else ""
+      logger.debug(f"Analyzing site {tab_info}({i}/{total}): {url}")
+      site_info, get_rating = SiteInfo.get_status_report(url, include_ssl_rating, self._get_probe_options(url))
+      if get_rating:
+        future = ssl_rating.SSLReport.submit_site_rating(site_info.url, site_info.ssl_fingerprint)
+        with progress_lock:
+          ratings[(sheet, url)] = future
+      return [site_info]
 
-  def _reconfirm_sites(self, report):
-    has_down_sites = False
-    for record in report:
-      if not record.online:
-        status = SiteInfo.get_status(record.url)
+    def reprobe(result, sheet, total, url):
+      # only the status of records that are down is rechecked, SSL details stay from the first probe
+      status = SiteInfo.get_status(result[0].url, probe=self._get_probe_options(url))
+      for record in result:
+        if record.online:
+          continue
         record.alive = status.alive
         record.online = status.online
         record.error = status.error
-        if not status.online:
-          has_down_sites = True
-        else:
-          logger.info(f"Site is now online: {record.url}")
-    return has_down_sites
+        record.response_time = status.response_time
+        record.dns_time, record.connect_time, record.tls_time = status.dns_time, status.connect_time, status.tls_time
+        record.ttfb_time, record.body_time = status.ttfb_time, status.body_time
+      if status.online:
+        logger.info(f"Site is now online: {url}")
+      return result
 
-  def _get_report_blocked(self, urls):
-    report_blocked = []
-    total = len(urls)
-    i = 1
+    def is_down(result):
+      return any(not record.online for record in result)
+
+    # group results back by sheet, keeping the original order
+    results = {sheet: [] for sheet in urls_by_sheet}
+    has_down_sites = False
+    for job, result in zip(jobs, self._engine.run(jobs, probe, reprobe, is_down)):
+      sheet, url = job[0], job[-1]
+      if isinstance(result, Exception):
+        logger.error(f"Probe for {url} failed: {result}")
+        continue
+      if (sheet, url) in ratings:
+        result = SiteInfo.add_ssl_ratings(result[0], ratings[(sheet, url)].result()) or result
+      if not result[0].online:
+        has_down_sites = True
+      elif not result[0].error and result[0].response_time:
+        # only good responses shape the site's latency model
+        self._latency_model.record(url, result[0].response_time)
+      results[sheet].extend(result)
+      if records_by_url is not None:
+        records_by_url[(sheet, url)] = result
+    self._latency_model.save()
+
+    full_report = []
+    for sheet in urls_by_sheet:
+      full_report.extend(results[sheet])
+    return full_report, has_down_sites
+
+  def _submit_blocked_checks(self, urls):
+    """Start checking internal URLs concurrently in the background, returns [(url, future)]"""
+    checks = []
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=self._blocked_workers, thread_name_prefix="blocked")
     for url in urls:
-      if '://' not in url:
-        # assume https
-        url = f"https://{url}"
+      url = self._get_job_url(url)
       if not SiteInfo.is_valid_url(url):
         logger.warning(f"Skipping invalid URL: {url}")
         continue
-      logger.debug(f"Analyzing INTERNAL site ({i}/{total}): {url}")
-      i += 1
-      if SiteInfo.is_blocked(url):
+      checks.append((url, executor.submit(SiteInfo.is_blocked, url, self._blocked_timeout)))
+    executor.shutdown(wait=False)
+    logger.debug(f"Checking {len(checks)} INTERNAL sites in background")
+    return checks
+
+  def _collect_blocked_report(self, checks, records_by_url=None):
+    """Records of internal URLs found reachable, records_by_url (if given) gets them by (None, URL)"""
+    report_blocked = []
+    for url, future in checks:
+      try:
+        blocked = future.result()
+      except Exception as e:
+        logger.error(f"Blocked check for {url} failed: {e}")
         continue
-      # if online, means mis-configuration
-      record = SiteRecord(url=url, alive=True, online=True, error="Internal URL not blocked.")
-      report_blocked.append(record)
+      records = []
+      if not blocked:
+        # if online, means mis-configuration
+        records.append(SiteRecord(url=url, alive=True, online=True, error="Internal URL not blocked."))
+      report_blocked.extend(records)
+      if records_by_url is not None:
+        records_by_url[(None, url)] = records
     return report_blocked
 
-  def _render_template(self, template, report, outputfile=None):
+  def _get_report_blocked(self, urls):
+    return self._collect_blocked_report(self._submit_blocked_checks(urls))
+
+  def _fill_locations(self, report):
+    """Fill in city/region/country of each record's IP, mostly from the location cache"""
+    t_start = time.perf_counter()
+    locations = web_util.get_ip_locations([record.ip for record in report if record.ip])
+    for record in report:
+      if record.ip in locations:
+        record.city, record.region, record.country = locations[record.ip]
+    logger.debug(f"Located {len(locations)} IPs in {int((time.perf_counter() - t_start) * 1000)}ms")
+
+  def _render_template(self, template_file, report):
     """Render output based on list of SiteRecord objects"""
-    engine = jinja2.Template(template)
-    html = engine.render(sites=report)
-    if outputfile:
-      with open(outputfile, 'w') as f:
-        f.write(html)
-    return html
+    import template_util  # jinja2 is only needed when a report goes out
+    # compiled templates are kept with the other caches, so they survive restarts
+    template_util.configure_templates(bytecode_cache_dir=os.path.join(self._cache_dir, "templates"))
+    return template_util.render_template(template_file, sites=report)
 
   def _generate_xlsx_report(self, report, outputfile=None):
-    """Generate Excel report with site report data using openpyxl"""
-    # Create a new workbook and worksheet
-    workbook = openpyxl.Workbook()
-    worksheet = workbook.active
-    worksheet.title = 'Site Report'
-    
-    # Create header with formatting
-    header_font = openpyxl.styles.Font(bold=True)
-    good_font = openpyxl.styles.Font(bold=True, color="00800000")  # Green
-    bad_font = openpyxl.styles.Font(bold=True, color="00FF0000")   # Red
-    
-    headers = ['On', 'Grade', 'Expires In (days)', 'URL', 'IP', 'Error', 'City', 'Region', 'Country']
-    column_widths = [4, 6, 18, 40, 15, 40, 10, 10, 8]
-    
-    # Set headers
-    for col, (header, width) in enumerate(zip(headers, column_widths), 1):
-      cell = worksheet.cell(row=1, column=col, value=header)
-      cell.font = header_font
-      worksheet.column_dimensions[cell.column_letter].width = width
-    
-    # Add auto-filter
-    worksheet.auto_filter.ref = f"A1:{worksheet.cell(row=1, column=len(headers)).coordinate}"
-    
+    """Generate Excel report bytes with site report data (streamed with openpyxl write-only mode)"""
+    import openpyxl
+    import openpyxl.cell
+    import openpyxl.styles
+    import openpyxl.utils
+    workbook = openpyxl.Workbook(write_only=True)
+    # shared named styles instead of per-cell fonts
+    workbook.add_named_style(openpyxl.styles.NamedStyle(name='Report Header', font=openpyxl.styles.Font(bold=True)))
+    workbook.add_named_style(openpyxl.styles.NamedStyle(name='Report Good', font=openpyxl.styles.Font(bold=True, color="00800000")))  # Green
+    workbook.add_named_style(openpyxl.styles.NamedStyle(name='Report Bad', font=openpyxl.styles.Font(bold=True, color="00FF0000")))   # Red
+    worksheet = workbook.create_sheet('Site Report')
+
+    def cell(value, style=None, hyperlink=None):
+      if style is None and hyperlink is None:
+        return value
+      c = openpyxl.cell.WriteOnlyCell(worksheet, value=value)
+      if hyperlink:
+        c.hyperlink = hyperlink
+      if style:
+        c.style = style
+      return c
+
+    def good_or_bad(is_good):
+      return 'Report Good' if is_good else 'Report Bad'
+
+    headers = ['On', 'Grade', 'Expires In (days)', 'URL', 'IP', 'Error', 'City', 'Region', 'Country',
+               'Time (ms)', 'DNS (ms)', 'Connect (ms)', 'TLS (ms)', 'TTFB (ms)', 'Body (ms)']
+    column_widths = [4, 6, 18, 40, 15, 40, 10, 10, 8, 10, 10, 13, 10, 11, 11]
+
+    # column widths and auto-filter must be set before rows are streamed
+    for col, width in enumerate(column_widths, 1):
+      worksheet.column_dimensions[openpyxl.utils.get_column_letter(col)].width = width
+    worksheet.auto_filter.ref = f"A1:{openpyxl.utils.get_column_letter(len(headers))}1"
+    worksheet.append([cell(header, 'Report Header') for header in headers])
+
     # Fill in sheet with report data
-    for row_idx, record in enumerate(report, 2):  # Start from row 2
-      # Online status
-      online_cell = worksheet.cell(row=row_idx, column=1, value='Y' if record.online else 'N')
-      online_cell.font = good_font if record.online else bad_font
-      
-      # SSL Grade
-      if record.ssl_rating:
-        grade_cell = worksheet.cell(row=row_idx, column=2, value=record.ssl_rating)
-        grade_cell.font = good_font if record.ssl_rating.startswith('A') else bad_font
-      
-      # SSL Expires
-      if record.ssl_expires:
-        expires_cell = worksheet.cell(row=row_idx, column=3, value=record.ssl_expires)
-        expires_cell.font = good_font if record.ssl_expires > 60 else bad_font
-      
-      # URL (with hyperlink if SSL report available)
-      url_cell = worksheet.cell(row=row_idx, column=4, value=record.url)
-      if record.ssl_report:
-        url_cell.hyperlink = record.ssl_report
-        url_cell.style = "Hyperlink"
-      
-      # IP Address
-      worksheet.cell(row=row_idx, column=5, value=record.ip)
-      
-      # Error
-      if record.error:
-        error_cell = worksheet.cell(row=row_idx, column=6, value=record.error)
-        error_cell.font = bad_font
-      
-      # Location columns (currently not populated as noted in original code)
-      # Columns 7-9 for City, Region, Country left empty as in original
-    
-    # Save or return as bytes
+    for record in report:
+      row = [
+        # Online status
+        cell('Y' if record.online else 'N', good_or_bad(record.online)),
+        # SSL Grade
+        cell(record.ssl_rating, good_or_bad(record.ssl_rating.startswith('A'))) if record.ssl_rating else None,
+        # SSL Expires
+        cell(record.ssl_expires, good_or_bad(record.ssl_expires > 60)) if record.ssl_expires else None,
+        # URL (with hyperlink if SSL report available)
+        cell(record.url, 'Hyperlink', record.ssl_report) if record.ssl_report else record.url,
+        # IP Address
+        record.ip,
+        # Error
+        cell(record.error, 'Report Bad') if record.error else None,
+        # Location columns
+        record.city, record.region, record.country
+      ]
+      # Response time and its breakdown (only meaningful if site responded)
+      if record.response_time:
+        row += [record.response_time, record.dns_time, record.connect_time,
+                record.tls_time, record.ttfb_time, record.body_time]
+      # empty trailing cells don't need to be written
+      while row[-1] is None:
+        row.pop()
+      worksheet.append(row)
+
+    with io.BytesIO() as output:
+      workbook.save(output)
+      data = output.getvalue()
     if outputfile:
-      workbook.save(outputfile)
-      workbook.close()
-      return None
-    else:
-      # Save to BytesIO for in-memory handling
-      with io.BytesIO() as output:
-        workbook.save(output)
-        workbook.close()
-        output.seek(0)
-        return output.read()
-
-  def _send_email_report(self, report):
+      with open(outputfile, 'wb') as f:
+        f.write(data)
+    return data
+
+  def _send_email_report(self, report, xlsx_report=None):
     try:
       if not self._email_settings:
         logger.warning("Email settings not configured, skipping email report.")
@@ -522,12 +1008,8 @@ class WebMonitor:
       mapping = {'now': now, 'today': today}
       subject = self._email_settings.subject_formatter.format_map(mapping)
 
-      # Load email body template
-      with open(self._email_settings.body_template, 'r') as f:
-        template_content = f.read()
-      
-      # Render HTML content
-      html_content = self._render_template(template_content, report)
+      # Render HTML content (template is compiled once and reloaded only when changed)
+      html_content = self._render_template(self._email_settings.body_template, report)
       
       # Generate Excel attachment if enabled
       attachment_data = None
@@ -535,7 +1017,7 @@ class WebMonitor:
       attachment_type = None
       
       if self._email_settings.include_attachment:
-        attachment_data = self._generate_xlsx_report(report)
+        attachment_data = xlsx_report if xlsx_report else self._generate_xlsx_report(report)
         attachment_filename = f"{today}-Site-Report.xlsx"
         attachment_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
       success = self._email_settings.email_provider.send_email(
@@ -572,31 +1054,49 @@ class WebMonitor:
         "Content-Type": "application/json",
         "User-Agent": web_util.get_user_agent()
       }
-      r = requests.post(webhook_config.endpoint, headers=headers, data=payload)
+      r = web_util.get_http_session().post(webhook_config.endpoint, headers=headers, data=payload)
       if r.status_code > 400:
         logger.error(f"Post to webhook failed: {r.status_code}")
     except Exception as e:
       logger.error(f"Post to webhook failed: {e}")
 
   def _store_influxdb_report(self, report):
-    influxdb_settings = InfluxDBConfig(
-      endpoint=self._influxdb_settings.endpoint,
-      token=self._influxdb_settings.token,
-      tenant=self._influxdb_settings.tenant,
-      bucket=self._influxdb_settings.bucket
-      )
-    influxdb_writer = influxdb.InfluxDBHelper(influxdb_settings)
+    """Write metrics of all sites in one batched request, in the background"""
+    import influxdb  # influxdb_client takes longer to import than anything else here
+    if not self._influxdb_writer:
+      influxdb_settings = InfluxDBConfig(
+        endpoint=self._influxdb_settings.endpoint,
+        token=self._influxdb_settings.token,
+        tenant=self._influxdb_settings.tenant,
+        bucket=self._influxdb_settings.bucket
+        )
+      self._influxdb_writer = influxdb.InfluxDBHelper(influxdb_settings, enable_gzip=True)
     logger.debug("Storing metrics into InfluxDB...")
+    records = []
     for record in report:
       parsed_uri = urllib.parse.urlparse(record.url)
       data = []
       if not record.error:
         data.append(("Response_Time", record.response_time))
+        data.append(("DNS_Time", record.dns_time))
+        data.append(("Connect_Time", record.connect_time))
+        data.append(("TLS_Time", record.tls_time))
+        data.append(("TTFB_Time", record.ttfb_time))
+        data.append(("Body_Time", record.body_time))
+      if record.ssl_scan_time:
+        data.append(("SSL_Queue_Time", record.ssl_queue_time))
+        data.append(("SSL_Scan_Time", record.ssl_scan_time))
       data.append(("Offline", 0 if record.online else 1))
-      try:
-        influxdb_writer.report_data_list("Metrics", parsed_uri.hostname, data)
-      except Exception as e:
-        logger.error(f"Failed to store InfluxDB record: {parsed_uri.hostname}: {e}")
+      records.append((parsed_uri.hostname, data))
+    try:
+      points = influxdb.InfluxDBHelper.create_points("Metrics", records)
+      self._influxdb_writer.report_points_async(points)
+    except Exception as e:
+      logger.error(f"Failed to store InfluxDB records: {e}")
+
+  def _flush_influxdb_report(self, timeout=None):
+    if self._influxdb_writer and not self._influxdb_writer.flush(timeout):
+      logger.warning("InfluxDB write is still in progress.")
 
 
   #########################################
@@ -610,16 +1110,89 @@ class WebMonitor:
       config = configparser.ConfigParser()
       config.read(configfile)
       self._config_dir = os.path.dirname(configfile)
-      self._retry_delay = config.getint("Global", "RetryDelay", fallback=120)
-      self._max_retries = config.getint("Global", "MaxRetries", fallback=5)
+      # persistent caches live next to the config unless told otherwise
+      self._cache_dir = config.get("Global", "CacheDir", fallback=self._config_dir).strip('" ')
+      # size of the worker pool shared by all sheets (MaxConcurrency is the older name)
+      workers = config.getint("Global", "Workers", fallback=config.getint("Global", "MaxConcurrency", fallback=8))
+      self._engine = ProbeEngine(
+        workers=workers,
+        host_concurrency=config.getint("Global", "HostConcurrency", fallback=2),
+        host_rate=config.getfloat("Global", "HostRate", fallback=1.0),
+        # failed sites are retried after RetryBaseDelay seconds, doubling up to RetryDelay
+        max_retries=config.getint("Global", "MaxRetries", fallback=5),
+        retry_base_delay=config.getint("Global", "RetryBaseDelay", fallback=15),
+        retry_max_delay=config.getint("Global", "RetryDelay", fallback=120))
+      # keep-alive pools for all outbound HTTP calls, one pooled connection per worker at least
+      web_util.configure_http_sessions(
+        pool_connections=config.getint("HTTP", "PoolConnections", fallback=32),
+        pool_maxsize=config.getint("HTTP", "PoolMaxSize", fallback=max(10, workers)),
+        retries=config.getint("HTTP", "Retries", fallback=0),
+        timeout=config.getint("HTTP", "Timeout", fallback=60))
+      # IP locations in reports: cached for GeoCacheDays, from GeoDatabase (MMDB) if set,
+      # otherwise ipinfo (batch lookups with IPINFO_TOKEN env variable); without either, lookups
+      # are slow and send IPs to a third party, so they are off unless asked for
+      geo_database = config.get("Global", "GeoDatabase", fallback="").strip('" ') or None
+      has_geo_source = bool(geo_database or os.environ.get("IPINFO_TOKEN", "").strip('" '))
+      self._include_locations = config.getboolean("Global", "Locations", fallback=has_geo_source)
+      web_util.configure_geolocation(
+        cache_file=config.get("Global", "GeoCacheFile", fallback=os.path.join(self._cache_dir, "ip-location-cache.json")).strip('" '),
+        ttl_days=config.getint("Global", "GeoCacheDays", fallback=30),
+        mmdb_file=geo_database)
+      # latest browser user agent, refreshed daily (the default cache location may be read-only)
+      web_util.configure_user_agent(
+        cache_file=config.get("Global", "UserAgentCacheFile", fallback=os.path.join(self._cache_dir, "user-agent.json")).strip('" '))
+      # internal URLs are expected to time out, so they get a short (connect, read) budget
+      self._blocked_timeout = (config.getfloat("Global", "BlockedConnectTimeout", fallback=5),
+                               config.getfloat("Global", "BlockedReadTimeout", fallback=10))
+      self._blocked_workers = config.getint("Global", "BlockedWorkers", fallback=8)
+      # hosts failing to connect BreakerThreshold times in a row are skipped, then probed again
+      # after BreakerCooldown seconds (doubling while the host stays down), 0 to disable
+      web_util.configure_circuit_breaker(
+        threshold=config.getint("Global", "BreakerThreshold", fallback=3),
+        cooldown=config.getint("Global", "BreakerCooldown", fallback=60))
       self._include_SSL_report = config.getboolean("SSL", "GetSSLReport", fallback=False)
       self._include_SSL_grade = config.getboolean("SSL", "GenerateSSLRating", fallback=False)
+      # check intervals (minutes) used by daemon mode: per row (xlsx column D), per sheet, or global
+      self._check_interval = config.getfloat("Global", "CheckInterval", fallback=15) * 60
+      # reports are also archived locally (empty to disable)
+      self._archive_folder = config.get("Global", "ArchiveFolder", fallback="/tmp/dropbox_archive").strip('" ')
+      # minutes between full reports in daemon mode (0 for state change alerts only)
+      self._report_interval = config.getfloat("Global", "ReportInterval", fallback=1440) * 60
+      self._sheet_intervals = {}
+      if "Intervals" in config:
+        for sheet, value in config["Intervals"].items():
+          self._sheet_intervals[sheet] = self._parse_interval(value, f"sheet {sheet}")
+      # how sites are probed, can be overridden per row (xlsx columns E and F)
+      self._probe_options = ProbeOptions(
+        mode=config.get("Global", "ProbeMode", fallback="full").strip('" ').lower(),
+        max_bytes=config.getint("Global", "ProbeBytes", fallback=65536))
+      if self._probe_options.mode not in PROBE_MODES:
+        raise Exception(f"ProbeMode must be one of {', '.join(PROBE_MODES)}")
+      # timeouts (TimeoutFactor x p99, within MinTimeout..MaxTimeout seconds) and slow alerts
+      # (SlowFactor x p99, at least MinSlowThreshold ms) follow each site's own latency history
+      self._probe_options.timeout = config.getfloat("Global", "MaxTimeout", fallback=120)
+      self._probe_options.slow_threshold = config.getint("Global", "SlowThreshold", fallback=10000)
+      self._latency_model = LatencyModel(
+        config.get("Global", "LatencyHistoryFile", fallback=os.path.join(self._cache_dir, "latency-history.json")).strip('" '),
+        min_samples=config.getint("Global", "LatencyMinSamples", fallback=20),
+        timeout_factor=config.getfloat("Global", "TimeoutFactor", fallback=4),
+        min_timeout=config.getfloat("Global", "MinTimeout", fallback=10),
+        max_timeout=self._probe_options.timeout,
+        slow_factor=config.getfloat("Global", "SlowFactor", fallback=2),
+        min_slow_threshold=config.getint("Global", "MinSlowThreshold", fallback=2000))
       url_list_file = config["Global"]["URLFile"]
       if url_list_file == os.path.basename(url_list_file):
         url_list_file = os.path.join(self._config_dir, url_list_file)
-      self._URLs_by_sheet = self._load_urls(url_list_file)
+      self._url_list_file = url_list_file
+      self._url_list_mtime = os.path.getmtime(url_list_file) if os.path.isfile(url_list_file) else None
+      try:
+        self._URLs_by_sheet = self._load_urls(url_list_file)
+      except Exception as e:
+        logger.critical(f"{e}")
+        sys.exit(1)
       self._email_settings = self._load_email_config(config, "Email")
       self._influxdb_settings = self._load_influxdb_config(config, "InfluxDB")
+      self._influxdb_writer = None
       self._webhook_settings = self._load_webhook_config(config, "WebHook")
       if self._include_SSL_report:
         ssl_rating.SSLReport.set_config(self._load_sslscanner_config(config["SSL"]))
@@ -627,64 +1200,252 @@ class WebMonitor:
       logger.error(f"Config file {configfile} is invalid: {e}")
       raise
 
-  def check_sites(self):
-    full_report, has_down_sites = self._get_report_multithreaded(self._URLs_by_sheet, self._include_SSL_report)
-    # reconfirm failed sites
-    retries = 0
-    while has_down_sites and retries < self._max_retries:
-      retries += 1
-      logger.info(f"Wait some time and retry (#{retries}) failed sites.")
-      time.sleep(self._retry_delay)
-      has_down_sites = self._reconfirm_sites(full_report)
-    if len(full_report) == 0:
-      logger.error(f"Site report list is empty.")
-      return
+  @staticmethod
+  def _sort_report(report):
+    """Sort by SSL days left, offline first, then SSL grade and error (both descending), in one stable pass"""
+    # each key is replaced by its rank (descending ones reversed), packed into one integer per record
+    expires = {days: rank for rank, days in enumerate(sorted({i.ssl_expires or 0 for i in report}))}
+    grades = {grade: rank for rank, grade in enumerate(sorted({i.ssl_rating or 'Unknown' for i in report}, reverse=True))}
+    errors = {error: rank for rank, error in enumerate(sorted({i.error or '' for i in report}, reverse=True))}
+    num_grades, num_errors = len(grades), len(errors)
+    report.sort(key=lambda i: ((expires[i.ssl_expires or 0] * 2 + i.online) * num_grades + grades[i.ssl_rating or 'Unknown']) * num_errors + errors[i.error or ''])
+    return report
+
+  @staticmethod
+  def _summarize_report(report):
+    """Count errors, offline sites and SSL expiry buckets in one pass"""
+    summary = ReportSummary(total=len(report))
+    errors = offline = expired = expires_30 = expires_60 = later = unknown = 0
+    for record in report:
+      if record.error:
+        errors += 1
+      if not record.online:
+        offline += 1
+      days = record.ssl_expires
+      if days == '' or days is None:
+        unknown += 1
+      elif days <= 0:
+        expired += 1
+      elif days <= 30:
+        expires_30 += 1
+      elif days <= 60:
+        expires_60 += 1
+      else:
+        later += 1
+    summary.errors, summary.offline = errors, offline
+    summary.online_ratio = (len(report) - offline) / len(report) if report else 0.0
+    summary.ssl_expired, summary.ssl_expires_30, summary.ssl_expires_60 = expired, expires_30, expires_60
+    summary.ssl_expires_later, summary.ssl_unknown = later, unknown
+    return summary
+
+  def _probe_urls(self, urls_by_sheet, urls_blocked=None, records_by_url=None):
+    """Check sites and internal URLs once, returns (report, has_down_sites)"""
+    # internal URLs are checked alongside the main scan
+    blocked_checks = self._submit_blocked_checks(urls_blocked) if urls_blocked else []
+    # failed sites are retried by the engine while other sites are checked
+    full_report, has_down_sites = self._get_report_multithreaded(urls_by_sheet, self._include_SSL_report, records_by_url)
+    http_stats = web_util.get_http_stats()
+    logger.debug(f"HTTP connections: {http_stats['new_connections']} new, {http_stats['reused_connections']} reused")
+    dns_stats = web_util.get_dns_stats()
+    logger.debug(f"DNS cache: {dns_stats['hits']} hits, {dns_stats['misses']} misses")
+    circuit_stats = web_util.get_circuit_stats()
+    if circuit_stats["opened"] or circuit_stats["short_circuited"]:
+      logger.info(f"Circuit breakers: {circuit_stats['open']} open, {circuit_stats['opened']} opened, "
+                  f"{circuit_stats['closed']} closed, {circuit_stats['short_circuited']} probes skipped")
     # check if any of blocked sites are accessible
-    if '_URLS_BLOCKED' in dir(self):
-      full_report.extend(self._get_report_blocked(self._URLS_BLOCKED))
+    if blocked_checks:
+      full_report.extend(self._collect_blocked_report(blocked_checks, records_by_url))
+    return full_report, has_down_sites
+
+  def _send_reports(self, full_report, has_down_sites):
+    """Sort the report, then email, post and archive it if there is anything to tell"""
     # sort list to move items with error to front
-    full_report.sort(key=lambda i: i.error if i.error else '', reverse=True)
-    full_report.sort(key=lambda i: i.ssl_rating if i.ssl_rating else 'Unknown', reverse=True)
-    full_report.sort(key=lambda i: i.online)
-    full_report.sort(key=lambda i: i.ssl_expires if i.ssl_expires else 0)
-    num_errors = sum(1 for x in full_report if x.error)
-    # always record metrics stats
-    if self._influxdb_settings:
-      self._store_influxdb_report(full_report)
+    self._sort_report(full_report)
+    summary = self._summarize_report(full_report)
+    logger.debug(f"Report: {summary.total} URLs, {summary.online_ratio:.1%} online, {summary.errors} errors, "
+                 f"SSL expired {summary.ssl_expired}, within 30 days {summary.ssl_expires_30}, within 60 days {summary.ssl_expires_60}")
+    num_errors = summary.errors
     # send email if ssl rating included, or has failed sites, or has errors
     if self._include_SSL_report or has_down_sites or num_errors > 0:
+      if self._include_locations:
+        self._fill_locations(full_report)
+      # build the Excel report once, for both the attachment and the archive
+      xlsx_report = self._generate_xlsx_report(full_report)
       if self._email_settings:
-        self._send_email_report(full_report)
+        self._send_email_report(full_report, xlsx_report)
       if self._webhook_settings:
         self._send_webhook_notice(full_report)
       # also archive the report locally, in case email gets lost
-      now = datetime.datetime.now()
-      archive_folder = '/tmp/dropbox_archive'
-      if not os.path.exists(archive_folder):
-        os.makedirs(archive_folder)
-      report_file = f"{archive_folder}/Site-Report-{now.strftime('%Y-%m-%d_%H_%M_%S')}.xlsx"
-      
-      # Generate and save Excel report
-      self._generate_xlsx_report(full_report, report_file)
+      if self._archive_folder:
+        now = datetime.datetime.now()
+        if not os.path.exists(self._archive_folder):
+          os.makedirs(self._archive_folder)
+        report_file = f"{self._archive_folder}/Site-Report-{now.strftime('%Y-%m-%d_%H_%M_%S')}.xlsx"
+        with open(report_file, 'wb') as f:
+          f.write(xlsx_report)
       if num_errors > 0:
         logger.error(f"Scan completed: {num_errors} of {len(full_report)} URLs have errors.")
       else:
         logger.info(f"Scan completed: no errors for {len(full_report)} URLs.")
 
+  def _send_state_changes(self, previous, records_by_url):
+    """Alert on sites that went down (or internal URLs that became reachable) and on their recovery"""
+    def is_down(key, records):
+      # internal URLs only have a record when they are reachable
+      return bool(records) if key[0] is None else any(not record.online for record in records)
+
+    went_down, recovered = [], []
+    for key, records in records_by_url.items():
+      down = is_down(key, records)
+      was_down = key in previous and is_down(key, previous[key])
+      if down and not was_down:
+        logger.warning(f"Site went down: {key[1]}")
+        went_down.extend(records)
+      elif was_down and not down:
+        logger.info(f"Site recovered: {key[1]}")
+        recovered.extend(records)
+    if not went_down and not recovered:
+      return
+    changed = self._sort_report(went_down + recovered)
+    if self._email_settings:
+      self._send_email_report(changed)
+    if self._webhook_settings and went_down:
+      self._send_webhook_notice(went_down)
+
+  def _check_urls(self, urls_by_sheet, urls_blocked=None):
+    full_report, has_down_sites = self._probe_urls(urls_by_sheet, urls_blocked)
+    if len(full_report) == 0 and not urls_blocked:
+      logger.error(f"Site report list is empty.")
+      return full_report
+    # always record metrics stats (written in the background while reports go out)
+    if self._influxdb_settings:
+      self._store_influxdb_report(full_report)
+    self._send_reports(full_report, has_down_sites)
+    self._flush_influxdb_report()
+    return full_report
+
+  def check_sites(self):
+    """Check all sites once, returns the list of SiteRecord objects"""
+    return self._check_urls(self._URLs_by_sheet, getattr(self, '_URLS_BLOCKED', None))
+
+  def _get_check_interval(self, sheet, url):
+    if url in self._URL_intervals:
+      return self._URL_intervals[url]
+    return self._sheet_intervals.get(sheet.lower(), self._check_interval)
+
+  def _reload_urls_if_changed(self):
+    """Reload site list if the file changed, returns True if reloaded"""
+    try:
+      mtime = os.path.getmtime(self._url_list_file)
+      if mtime == self._url_list_mtime:
+        return False
+      logger.info(f"Site list changed, reloading [{self._url_list_file}]")
+      # a list still being written fails to load, and is retried on the next change of mtime
+      self._url_list_mtime = mtime
+      self._URLs_by_sheet = self._load_urls(self._url_list_file)
+      return True
+    except Exception as e:
+      logger.error(f"Failed to reload site list, keeping the previous one: {e}")
+      return False
+
+  def _build_schedule(self, old_schedule=None):
+    """Heap of (due time, sequence, sheet, url), keeping due times of URLs already scheduled"""
+    due_times = {(sheet, url): due for due, _, sheet, url in old_schedule or []}
+    now = time.monotonic()
+    entries = [(sheet, url) for sheet, urls in self._URLs_by_sheet.items() for url in urls]
+    # Internal URLs are scheduled like a sheet, but checked as blocked URLs
+    entries += [(None, url) for url in getattr(self, '_URLS_BLOCKED', [])]
+    schedule = []
+    for sheet, url in entries:
+      heapq.heappush(schedule, (due_times.get((sheet, url), now), next(self._schedule_seq), sheet, url))
+    return schedule
+
+  def serve(self):
+    """Keep running and check every site on its own interval"""
+    self._schedule_seq = itertools.count()
+    schedule = self._build_schedule()
+    logger.info(f"Monitoring {len(schedule)} URLs.")
+    # (sheet, URL) -> records of its last check (sheet is None for internal URLs), for the full report
+    latest = {}
+    # the full report goes out right after the first pass, then every ReportInterval
+    next_report = 0
+    while True:
+      # cheap unless the cached user agent has expired, then refreshed in the background
+      web_util.get_latest_user_agent()
+      if self._reload_urls_if_changed():
+        schedule = self._build_schedule(schedule)
+        current = {(sheet, self._get_job_url(url)) for _, _, sheet, url in schedule}
+        latest = {key: records for key, records in latest.items() if key in current}
+      if not schedule:
+        time.sleep(60)
+        continue
+      wait = schedule[0][0] - time.monotonic()
+      if wait > 0:
+        # wake up at least every minute to notice site list changes
+        time.sleep(min(wait, 60))
+        continue
+      # take everything that is due as one batch
+      now = time.monotonic()
+      urls_by_sheet = {}
+      urls_blocked = []
+      while schedule and schedule[0][0] <= now:
+        _, _, sheet, url = heapq.heappop(schedule)
+        if sheet is None:
+          urls_blocked.append(url)
+        else:
+          urls_by_sheet.setdefault(sheet, []).append(url)
+      # batches only alert on sites changing state, the full report has its own schedule
+      try:
+        records_by_url = {}
+        report, _ = self._probe_urls(urls_by_sheet, urls_blocked, records_by_url)
+        if self._influxdb_settings and report:
+          self._store_influxdb_report(report)
+        if latest:
+          self._send_state_changes(latest, records_by_url)
+        latest.update(records_by_url)
+        self._flush_influxdb_report()
+      except Exception as e:
+        logger.exception(f"Checking sites failed: {e}")
+      if self._report_interval > 0 and latest and time.monotonic() >= next_report:
+        try:
+          full_report = [record for records in latest.values() for record in records]
+          self._send_reports(full_report, any(not record.online for record in full_report))
+        except Exception as e:
+          logger.exception(f"Sending site report failed: {e}")
+        next_report = time.monotonic() + self._report_interval
+      finished = time.monotonic()
+      for sheet, urls in urls_by_sheet.items():
+        for url in urls:
+          heapq.heappush(schedule, (finished + self._get_check_interval(sheet, url), next(self._schedule_seq), sheet, url))
+      for url in urls_blocked:
+        heapq.heappush(schedule, (finished + self._get_check_interval('Internal', url), next(self._schedule_seq), None, url))
+
 ########################################
 # CLI interface
 ########################################
 
 def check_sites(args):
-  web_util.get_latest_user_agent()
   monitor = WebMonitor(args.config)
+  web_util.get_latest_user_agent()
   monitor.check_sites()
 
+def serve(args):
+  monitor = WebMonitor(args.config)
+  monitor.serve()
+
 #################################
 # Program starts
 #################################
 if (__name__ == '__main__') and ('UNIT_TEST' not in os.environ):
-  CLI_config = { 'func':check_sites, 'arguments': [
-    {'name':'config', 'help':'Config file for monitor'} 
+  CLI_config = { 'commands': [
+    {'name':'check', 'help':'Check all sites once', 'func':check_sites, 'params': [
+      {'name':'config', 'help':'Config file for monitor'}
+      ]},
+    {'name':'serve', 'help':'Keep running and check each site on its own interval', 'func':serve, 'params': [
+      {'name':'config', 'help':'Config file for monitor'}
+      ]}
     ]}
+  # "web-monitor.py <config>" still means a one-pass check
+  if len(sys.argv) > 1 and sys.argv[1] not in ('check', 'serve') and not sys.argv[1].startswith('-'):
+    sys.argv.insert(1, 'check')
   common.CLIParser.run(CLI_config)
@@ -1,72 +1,583 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+import json
 import time
+import datetime
+import hashlib
 import socket
+import threading
+import asyncio
 import ipaddress
 import urllib.parse
+import http.cookiejar
 import requests
-import dns.resolver
+import requests.adapters
+import urllib3.connection
+import urllib3.connectionpool
+import urllib3.exceptions
+import urllib3.util.connection
+import urllib3.util.retry
 import common
 
 # Initialize logger
 logger = common.Logger.getLogger()
 
+# urllib3 1.26 (Debian/Raspberry Pi default) has no NameResolutionError, DNS failures are NewConnectionErrors there
+_NameResolutionError = getattr(urllib3.exceptions, "NameResolutionError", None)
+
+class DNSCache:
+  """Process-wide DNS cache honouring record TTLs, with negative caching of unknown names"""
+
+  _lock = threading.Lock()
+  _entries = {}     # key -> (expires_at, addresses, error)
+  _pending = {}     # key -> event, so concurrent lookups of the same name query once
+  _resolver = None
+  _default_resolver = None  # for resolve() without a resolver
+  _nameservers = None  # None: dnspython's default (system) configuration
+  _hosts = None
+  _default_ttl = 300  # when TTL is unknown (hosts file, search domains)
+  _negative_ttl = 30  # when the authority doesn't tell
+  _max_entries = 10000
+  _hits = 0
+  _misses = 0
+
+  @staticmethod
+  def configure(default_ttl=None, negative_ttl=None, nameservers=None):
+    if nameservers is not None:
+      DNSCache._nameservers = list(nameservers)
+      DNSCache._default_resolver = None
+    if default_ttl is not None:
+      DNSCache._default_ttl = default_ttl
+    if negative_ttl is not None:
+      DNSCache._negative_ttl = negative_ttl
+
+  @staticmethod
+  def _get_hosts():
+    # names from the hosts file must keep resolving the way the system does
+    if DNSCache._hosts is None:
+      hosts = set()
+      try:
+        with open("/etc/hosts", "r") as f:
+          for line in f:
+            hosts.update(name.lower() for name in line.split("#")[0].split()[1:])
+      except Exception:
+        pass
+      DNSCache._hosts = hosts
+    return DNSCache._hosts
+
+  @staticmethod
+  def _get_system_resolver():
+    if not DNSCache._resolver:
+      import dns.resolver  # dnspython is only loaded once a name needs resolving
+      resolver = dns.resolver.Resolver()
+      resolver.lifetime = 10
+      DNSCache._resolver = resolver
+    return DNSCache._resolver
+
+  @staticmethod
+  def _get_default_resolver():
+    import dns.resolver
+    if DNSCache._nameservers is None:
+      return dns.resolver.get_default_resolver()
+    if not DNSCache._default_resolver:
+      resolver = dns.resolver.Resolver(configure=False)
+      resolver.nameservers = DNSCache._nameservers
+      DNSCache._default_resolver = resolver
+    return DNSCache._default_resolver
+
+  @staticmethod
+  def _get_negative_ttl(error):
+    import dns.rdatatype
+    try:
+      for response in error.responses().values():
+        for rrset in response.authority:
+          if rrset.rdtype == dns.rdatatype.SOA:
+            return min(rrset.ttl, rrset[0].minimum)
+    except Exception:
+      pass
+    return DNSCache._negative_ttl
+
+  @staticmethod
+  def _query(host, rdtype, resolver):
+    """Query records with dnspython, returns (addresses, ttl)"""
+    import dns.resolver
+    try:
+      answer = resolver.resolve(host, rdtype)
+      return [record.address for record in answer], answer.rrset.ttl
+    except dns.resolver.NoAnswer:
+      return [], DNSCache._negative_ttl
+
+  @staticmethod
+  def _lookup_system(host):
+    """Resolve host to IPv4 then IPv6 addresses, returns (addresses, ttl)"""
+    name = host.lower().rstrip(".")
+    try:
+      # IP literals need no lookup
+      return [str(ipaddress.ip_address(name.strip("[]")))], DNSCache._default_ttl
+    except ValueError:
+      pass
+    if "." in name and name not in DNSCache._get_hosts():
+      try:
+        resolver = DNSCache._get_system_resolver()
+        addresses_v4, ttl_v4 = DNSCache._query(host, "A", resolver)
+        addresses_v6, ttl_v6 = DNSCache._query(host, "AAAA", resolver)
+        if addresses_v4 or addresses_v6:
+          ttls = [ttl for ttl, found in ((ttl_v4, addresses_v4), (ttl_v6, addresses_v6)) if found]
+          return addresses_v4 + addresses_v6, min(ttls)
+      except Exception:
+        # let the system resolver decide (search domains, nsswitch, resolver errors)
+        pass
+    addresses = []
+    for info in socket.getaddrinfo(host, None, 0, socket.SOCK_STREAM):
+      if info[4][0] not in addresses:
+        addresses.append(info[4][0])
+    # system resolver doesn't expose TTL, IPv4 first as with dnspython results
+    addresses.sort(key=lambda ip: ":" in ip)
+    return addresses, DNSCache._default_ttl
+
+  @staticmethod
+  def _cached(key, lookup):
+    """Return cached addresses for key, or run lookup() once for all waiting threads"""
+    while True:
+      with DNSCache._lock:
+        entry = DNSCache._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+          DNSCache._hits += 1
+          if entry[2]:
+            raise entry[2]
+          return entry[1]
+        pending = DNSCache._pending.get(key)
+        if not pending:
+          DNSCache._misses += 1
+          pending = DNSCache._pending[key] = threading.Event()
+          break
+      # another thread is resolving the same name
+      pending.wait()
+    addresses, error, ttl = None, None, 0
+    try:
+      addresses, ttl = lookup()
+    except socket.gaierror as e:
+      error = e
+      # temporary failures are not cached
+      ttl = 0 if e.errno == socket.EAI_AGAIN else DNSCache._negative_ttl
+    except Exception as e:
+      error = e
+      # NXDOMAIN can only come from dnspython, which is loaded by then
+      dns_resolver = sys.modules.get("dns.resolver")
+      if dns_resolver and isinstance(e, dns_resolver.NXDOMAIN):
+        ttl = DNSCache._get_negative_ttl(e)
+    with DNSCache._lock:
+      if ttl > 0:
+        if len(DNSCache._entries) >= DNSCache._max_entries:
+          now = time.monotonic()
+          DNSCache._entries = {k: v for k, v in DNSCache._entries.items() if v[0] > now}
+        DNSCache._entries[key] = (time.monotonic() + ttl, addresses, error)
+      del DNSCache._pending[key]
+    pending.set()
+    if error:
+      raise error
+    return addresses
+
+  @staticmethod
+  def get_addresses(host):
+    """Get IP addresses of host the way the system would resolve them"""
+    try:
+      ipaddress.ip_address(host)
+      return [host]
+    except ValueError:
+      pass
+    return DNSCache._cached(("system", host.lower()), lambda: DNSCache._lookup_system(host))
+
+  @staticmethod
+  def getaddrinfo(host, port, family=0, type=socket.SOCK_STREAM):
+    """Cached drop-in for socket.getaddrinfo (stream sockets)"""
+    results = []
+    for ip in DNSCache.get_addresses(host):
+      if ":" in ip:
+        if family in (0, socket.AF_INET6):
+          results.append((socket.AF_INET6, type, 0, "", (ip, port, 0, 0)))
+      elif family in (0, socket.AF_INET):
+        results.append((socket.AF_INET, type, 0, "", (ip, port)))
+    if not results:
+      raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+    return results
+
+  @staticmethod
+  def resolve(host, rdtype="A", resolver=None):
+    """Cached dns.resolver query (e.g. with custom name servers), returns list of addresses"""
+    resolver = resolver if resolver else DNSCache._get_default_resolver()
+    key = (tuple(resolver.nameservers), host.lower(), rdtype)
+    def lookup():
+      answer = resolver.resolve(host, rdtype)
+      return [record.address for record in answer], answer.rrset.ttl
+    return DNSCache._cached(key, lookup)
+
+  @staticmethod
+  def flush(host=None):
+    """Drop cached results of host (or everything)"""
+    with DNSCache._lock:
+      if host is None:
+        DNSCache._entries.clear()
+      else:
+        host = host.lower()
+        DNSCache._entries = {k: v for k, v in DNSCache._entries.items() if k[1] != host}
+
+  @staticmethod
+  def get_stats():
+    """Get hit/miss counters as a dict"""
+    with DNSCache._lock:
+      return {"hits": DNSCache._hits, "misses": DNSCache._misses, "entries": len(DNSCache._entries)}
+
+class HTTPSessions:
+  """Shared keep-alive sessions with per-host connection pools and reuse counters"""
+
+  _lock = threading.Lock()
+  _session = None
+  _pool_connections = 32  # number of hosts kept in the pool
+  _pool_maxsize = 10      # connections kept per host
+  _retries = 0            # retries on connection errors (not on HTTP status)
+  _timeout = 60           # default timeout when the caller doesn't pass one
+  _new_connections = 0
+  _reused_connections = 0
+
+  @staticmethod
+  def configure(pool_connections=None, pool_maxsize=None, retries=None, timeout=None):
+    """Change pool/retry/timeout policy, the shared session is rebuilt on next use"""
+    with HTTPSessions._lock:
+      if pool_connections is not None:
+        HTTPSessions._pool_connections = pool_connections
+      if pool_maxsize is not None:
+        HTTPSessions._pool_maxsize = pool_maxsize
+      if retries is not None:
+        HTTPSessions._retries = retries
+      if timeout is not None:
+        HTTPSessions._timeout = timeout
+      if HTTPSessions._session:
+        HTTPSessions._session.close()
+        HTTPSessions._session = None
+
+  @staticmethod
+  def _count_connection(is_new):
+    with HTTPSessions._lock:
+      if is_new:
+        HTTPSessions._new_connections += 1
+      else:
+        HTTPSessions._reused_connections += 1
+
+  @staticmethod
+  def get_session():
+    """Get the process-wide session (safe to share between threads)"""
+    session = HTTPSessions._session
+    if session:
+      return session
+    with HTTPSessions._lock:
+      if not HTTPSessions._session:
+        retries = urllib3.util.retry.Retry(total=HTTPSessions._retries, read=False, status=0,
+                                           backoff_factor=0.5, raise_on_status=False)
+        adapter = _PooledHTTPAdapter(timeout=HTTPSessions._timeout,
+                                     pool_connections=HTTPSessions._pool_connections,
+                                     pool_maxsize=HTTPSessions._pool_maxsize,
+                                     max_retries=retries)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # behave like one-off requests.get(): no cookies carried over between checks
+        session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        HTTPSessions._session = session
+      return HTTPSessions._session
+
+  @staticmethod
+  def get_phase_timings(response):
+    """Get DNS/connect/TLS durations (ms) of the connections behind a response, including its redirects"""
+    totals = {"dns": 0, "connect": 0, "tls": 0}
+    for r in response.history + [response]:
+      # copied when the response was created, the connection may have been reused since
+      timings = getattr(r, "phase_timings", None)
+      if timings is None:
+        timings = getattr(getattr(r.raw, "connection", None), "phase_timings", None) or {}
+      for phase in totals:
+        totals[phase] += timings.get(phase, 0)
+    return {phase: int(ns / 1000000) for phase, ns in totals.items()}
+
+  @staticmethod
+  def get_peer_info(response):
+    """Get peer IP and parsed certificate of the connection behind a streamed (not yet read) response"""
+    conn = getattr(response.raw, "connection", None)
+    return getattr(conn, "peer_ip", None), getattr(conn, "peer_cert", None)
+
+  @staticmethod
+  def get_stats():
+    """Get connection counters as a dict"""
+    with HTTPSessions._lock:
+      return {
+        "new_connections": HTTPSessions._new_connections,
+        "reused_connections": HTTPSessions._reused_connections
+      }
+
+class _TimedConnectionMixin:
+  """Record DNS, TCP connect and TLS handshake durations (ns) of a new connection"""
+
+  def _reset_timings(self):
+    # a reused keep-alive connection has no setup cost
+    self.phase_timings = {"dns": 0, "connect": 0, "tls": 0}
+
+  def _new_conn(self):
+    # same as urllib3's version, but resolve first so DNS and connect are timed separately
+    self._reset_timings()
+    t_start = time.perf_counter_ns()
+    try:
+      family = urllib3.util.connection.allowed_gai_family()
+      addresses = DNSCache.getaddrinfo(self._dns_host, self.port, family)
+    except socket.gaierror as e:
+      if _NameResolutionError:
+        raise _NameResolutionError(self.host, self, e) from e
+      raise urllib3.exceptions.NewConnectionError(self, f"Failed to resolve '{self.host}' ({e})") from e
+    t_resolved = time.perf_counter_ns()
+    error = None
+    sock = None
+    for address in addresses:
+      try:
+        sock = urllib3.util.connection.create_connection(
+          address[4][:2],
+          self.timeout,
+          source_address=self.source_address,
+          socket_options=self.socket_options,
+        )
+        break
+      except socket.timeout as e:
+        error = urllib3.exceptions.ConnectTimeoutError(
+          self, f"Connection to {self.host} timed out. (connect timeout={self.timeout})")
+      except OSError as e:
+        error = urllib3.exceptions.NewConnectionError(self, f"Failed to establish a new connection: {e}")
+    if not sock:
+      raise error if error else urllib3.exceptions.NewConnectionError(self, f"No address found for {self.host}")
+    self._t_connected = time.perf_counter_ns()
+    self.phase_timings["dns"] = t_resolved - t_start
+    self.phase_timings["connect"] = self._t_connected - t_resolved
+    return sock
+
+  def _capture_peer(self):
+    # kept for the connection's lifetime, so reused connections still know their peer
+    self.peer_ip = self.sock.getpeername()[0]
+    self.peer_cert = None
+
+class _TimedHTTPConnection(_TimedConnectionMixin, urllib3.connection.HTTPConnection):
+  def connect(self):
+    super().connect()
+    self._capture_peer()
+
+class _TimedHTTPSConnection(_TimedConnectionMixin, urllib3.connection.HTTPSConnection):
+  def connect(self):
+    super().connect()
+    self.phase_timings["tls"] = time.perf_counter_ns() - self._t_connected
+    self._capture_peer()
+    self.peer_cert = WebUtils.parse_certificate(self.sock.getpeercert(), self.sock.getpeercert(binary_form=True))
+
+class _PooledHTTPConnectionPool(urllib3.connectionpool.HTTPConnectionPool):
+  ConnectionCls = _TimedHTTPConnection
+
+  def _get_conn(self, timeout=None):
+    conn = super()._get_conn(timeout)
+    # a connection without socket will connect on first use
+    is_new = conn.sock is None
+    if not is_new:
+      conn._reset_timings()
+    HTTPSessions._count_connection(is_new)
+    return conn
+
+class _PooledHTTPSConnectionPool(urllib3.connectionpool.HTTPSConnectionPool):
+  ConnectionCls = _TimedHTTPSConnection
+
+  def _get_conn(self, timeout=None):
+    conn = super()._get_conn(timeout)
+    is_new = conn.sock is None
+    if not is_new:
+      conn._reset_timings()
+    HTTPSessions._count_connection(is_new)
+    return conn
+
+class _PooledHTTPAdapter(requests.adapters.HTTPAdapter):
+  def __init__(self, timeout=None, **kwargs):
+    self._timeout = timeout
+    super().__init__(**kwargs)
+
+  def init_poolmanager(self, *args, **kwargs):
+    super().init_poolmanager(*args, **kwargs)
+    self.poolmanager.pool_classes_by_scheme = {
+      "http": _PooledHTTPConnectionPool,
+      "https": _PooledHTTPSConnectionPool
+    }
+
+  def send(self, request, timeout=None, **kwargs):
+    if timeout is None:
+      timeout = self._timeout
+    response = super().send(request, timeout=timeout, **kwargs)
+    # a redirect to the same host reuses (and resets) the connection, so keep this request's setup times
+    conn = getattr(response.raw, "connection", None)
+    response.phase_timings = dict(getattr(conn, "phase_timings", None) or {})
+    return response
+
 class WebUtils:
   """Utility class for web-related functions like DNS resolution, IP location, etc."""
   
   # Class-level constant for user agent
   _USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36"
 
+  # latest user agent is cached on disk, shared by all tools using this module
+  _USER_AGENT_URL = "https://jnrbsn.github.io/user-agents/user-agents.json"
+  _USER_AGENT_CACHE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "web_util-user-agent.json")
+  _USER_AGENT_TTL = 86400
+  _USER_AGENT_RETRY = 3600  # seconds between attempts after a failed refresh
+  _user_agent_refresh = None
+  _user_agent_attempted = None  # monotonic time of the last refresh attempt
+  _user_agent_updated = None    # wall time of the last successful refresh, even if it couldn't be cached
+
+  @staticmethod
+  def configure_user_agent(cache_file=None, retry_delay=None):
+    """Change where the latest user agent is cached (and loads it from there) and the retry delay"""
+    if cache_file is not None:
+      WebUtils._USER_AGENT_CACHE = cache_file
+      WebUtils._load_cached_user_agent()
+    if retry_delay is not None:
+      WebUtils._USER_AGENT_RETRY = retry_delay
+
   @staticmethod
-  def get_latest_user_agent():
-    """Update the user agent string to the latest version"""
+  def _load_cached_user_agent():
+    """Use the cached user agent, returns its age in seconds (None if there is none)"""
     try:
-      url = "https://jnrbsn.github.io/user-agents/user-agents.json"
-      r = requests.get(url)
+      with open(WebUtils._USER_AGENT_CACHE, "r") as f:
+        data = json.load(f)
+      if data["user_agent"].startswith("Mozilla/"):
+        WebUtils._USER_AGENT = data["user_agent"]
+        return time.time() - data["time"]
+    except FileNotFoundError:
+      pass
+    except Exception as e:
+      logger.debug(f"Ignoring cached user agent [{WebUtils._USER_AGENT_CACHE}]: {e}")
+    return None
+
+  @staticmethod
+  def _fetch_latest_user_agent():
+    try:
+      r = HTTPSessions.get_session().get(WebUtils._USER_AGENT_URL, timeout=10)
       if r.status_code >= 400:
         logger.warning(f"Failed to get latest user agent list. (status={r.status_code})")
         return
       user_agent = r.json()[0]
-      if user_agent.startswith("Mozilla/") and user_agent != WebUtils._USER_AGENT:
+      if not user_agent.startswith("Mozilla/"):
+        return
+      if user_agent != WebUtils._USER_AGENT:
         logger.debug(f"Found a newer user agent: {user_agent}")
         WebUtils._USER_AGENT = user_agent
+      WebUtils._user_agent_updated = time.time()
+      os.makedirs(os.path.dirname(WebUtils._USER_AGENT_CACHE), exist_ok=True)
+      WebUtils.save_json(WebUtils._USER_AGENT_CACHE, {"user_agent": user_agent, "time": time.time()})
     except Exception as e:
       logger.warning(f"Failed to get the latest user agent list. ({e})")
 
   @staticmethod
-  def is_host_reachable(url):
-    """Check if a host is reachable using custom DNS and socket connection"""
+  def save_json(path, data, **kwargs):
+    """Write data as JSON to a temporary file and move it over path, so readers never see a partial file"""
+    temp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+      with open(temp_file, "w") as f:
+        json.dump(data, f, **kwargs)
+      os.replace(temp_file, path)
+    except BaseException:
+      try:
+        os.remove(temp_file)
+      except OSError:
+        pass
+      raise
+
+  @staticmethod
+  def get_latest_user_agent(background=True):
+    """Update the user agent string to the latest version, from the disk cache unless it has expired"""
+    if WebUtils._user_agent_updated and time.time() - WebUtils._user_agent_updated < WebUtils._USER_AGENT_TTL:
+      return
+    age = WebUtils._load_cached_user_agent()
+    if age is not None and age < WebUtils._USER_AGENT_TTL:
+      return
+    # a failed fetch (or cache write) is retried after a while, not on every call
+    now = time.monotonic()
+    if WebUtils._user_agent_attempted is not None and now - WebUtils._user_agent_attempted < WebUtils._USER_AGENT_RETRY:
+      return
+    if not background:
+      WebUtils._user_agent_attempted = now
+      WebUtils._fetch_latest_user_agent()
+      return
+    # the cached (or built-in) value is used until the refresh completes
+    if WebUtils._user_agent_refresh and WebUtils._user_agent_refresh.is_alive():
+      return
+    WebUtils._user_agent_attempted = now
+    WebUtils._user_agent_refresh = threading.Thread(target=WebUtils._fetch_latest_user_agent, name="user-agent-refresh", daemon=True)
+    WebUtils._user_agent_refresh.start()
+
+  @staticmethod
+  def is_host_reachable(url, timeout=10):
+    """Check if a host is reachable using custom DNS and socket connections to all its IPv4 addresses"""
     try:
       parsed_uri = urllib.parse.urlparse(url)
       host = parsed_uri.hostname if parsed_uri.hostname else url
-      port = parsed_uri.port if parsed_uri.port else 443
-      answers = dns.resolver.resolve(host, 'A')
-      if not answers:
+      port = parsed_uri.port if parsed_uri.port else (80 if parsed_uri.scheme == 'http' else 443)
+      latencies = WebUtils.probe_endpoints(host, port, timeout)
+      if not latencies:
         logger.error(f"Custom DNS lookup failed for {url}")
         return False
-      # verify each IP from results
-      for answer in answers:
-        ip = answer.address
-        try:
-          with socket.create_connection((ip, port), timeout=10) as conn:
-            logger.info(f"{url} IP address is reachable: {ip}")
-        except:
+      for ip, latency in latencies.items():
+        if latency is None:
           logger.info(f"{url} IP address is NOT reachable: {ip}")
-          return False
-      # now all IP addresses are verified, consider as OK for now
-      return True
+        else:
+          logger.info(f"{url} IP address is reachable: {ip} ({latency}ms)")
+      # every IPv4 address must answer, IPv6 only counts for IPv6-only hosts
+      ipv4 = [latency for ip, latency in latencies.items() if not WebUtils.is_ipv6(ip)]
+      return all(latency is not None for latency in (ipv4 or latencies.values()))
     except Exception as e:
       logger.error(f"Custom DNS lookup failed for {url}: {e}")
       return False
 
+  @staticmethod
+  async def _connect_all(addresses, port, timeout):
+    async def connect(ip):
+      t_start = time.perf_counter()
+      _, writer = await asyncio.open_connection(ip, port)
+      latency = int((time.perf_counter() - t_start) * 1000)
+      writer.close()
+      return latency
+    tasks = {ip: asyncio.ensure_future(connect(ip)) for ip in addresses}
+    # one deadline for all addresses, instead of one timeout per address
+    await asyncio.wait(tasks.values(), timeout=timeout)
+    latencies = {}
+    for ip, task in tasks.items():
+      if task.done() and not task.cancelled() and not task.exception():
+        latencies[ip] = task.result()
+      else:
+        task.cancel()
+        latencies[ip] = None
+    return latencies
+
+  @staticmethod
+  def probe_endpoints(host, port, timeout=10, resolver=None):
+    """Connect to all A and AAAA addresses of host at once, returns {ip: connect time in ms, or None if unreachable}"""
+    import dns.resolver
+    addresses = []
+    for rdtype in ('A', 'AAAA'):
+      try:
+        addresses += DNSCache.resolve(host, rdtype, resolver)
+      except (dns.resolver.NoAnswer, dns.resolver.NXDOMAIN):
+        # many hosts have no IPv6 records, some have no IPv4 ones
+        pass
+    if not addresses:
+      return {}
+    return asyncio.run(WebUtils._connect_all(addresses, port, timeout))
+
   @staticmethod
   def get_ip_addresses(host, port):
     """Get all IP addresses for a given host and port"""
     try:
-      addresses = []
-      addrInfo = socket.getaddrinfo(host, port)
-      for addr in addrInfo:
-        addresses.append(addr[4][0])
+      addresses = DNSCache.get_addresses(host)
       if addresses:
         return addresses, None
       else:
@@ -74,34 +585,43 @@ class WebUtils:
     except Exception as e:
       return None, f"Failed to get IP addresses for {host}: {e}"
 
+  @staticmethod
+  def parse_certificate(cert_info, cert_der=None):
+    """Get expiration, issuer, SANs and SHA256 fingerprint from a getpeercert() result"""
+    if not cert_info or 'notAfter' not in cert_info:
+      # certificate was not validated, so details are not available
+      return None
+    ssl_date_fmt = r'%b %d %H:%M:%S %Y %Z'
+    issuer = dict(item for rdn in cert_info.get('issuer', ()) for item in rdn)
+    return {
+      "expires": datetime.datetime.strptime(cert_info['notAfter'], ssl_date_fmt),
+      "issuer": issuer.get('commonName') or issuer.get('organizationName', ''),
+      "sans": [value for key, value in cert_info.get('subjectAltName', ()) if key == 'DNS'],
+      "fingerprint": hashlib.sha256(cert_der).hexdigest() if cert_der else ''
+    }
+
+  @staticmethod
+  def create_connection(host, port, timeout=None):
+    """Open a TCP connection to host, resolving through the DNS cache"""
+    error = None
+    for family, type, proto, _, sockaddr in DNSCache.getaddrinfo(host, port):
+      try:
+        return socket.create_connection(sockaddr[:2], timeout=timeout)
+      except OSError as e:
+        error = e
+    raise error
+
   @staticmethod
   def get_ip_location(ip):
     """Get geographic location information for an IP address"""
-    try:
-      url = f"https://ipinfo.io/{ip}/json"
-      time.sleep(2)   # avoid throttling
-      headers = {
-        "User-Agent": WebUtils._USER_AGENT
-      }
-      r = requests.get(url, headers=headers)
-      if r.status_code >= 400:
-        logger.warning(f"Failed to get location of IP: {ip} (status={r.status_code})")
-        return None, None, None
-      data = r.json()
-      city = data['city']
-      region = data['region']
-      country = data['country']
-      return city, region, country
-    except Exception as e:
-      logger.warning(f"Failed to get location of IP: {ip} ({e})")
-      return None, None, None
+    return GeoLocator.locate([ip]).get(ip, (None, None, None))
 
   @staticmethod
   def get_url_location(url):
     """Get geographic location information for a URL"""
     try:
       parsed_uri = urllib.parse.urlparse(url)
-      ip = socket.gethostbyname(parsed_uri.hostname)
+      ip = DNSCache.getaddrinfo(parsed_uri.hostname, None, socket.AF_INET)[0][4][0]
       return WebUtils.get_ip_location(ip)
     except Exception as e:
       logger.warning(f"Failed to get location of url: {url} ({e})")
@@ -120,7 +640,7 @@ class WebUtils:
   def is_valid_dns(fqdn):
     """Check if a FQDN can be resolved via DNS"""
     try:
-      socket.gethostbyname(fqdn)
+      DNSCache.get_addresses(fqdn)
       return True, None
     except Exception as e:
       return False, f"Failed to resolve {fqdn}: {e}"
@@ -135,12 +655,312 @@ class WebUtils:
     """Set a new user agent string"""
     WebUtils._USER_AGENT = new_user_agent
 
+class TokenBucket:
+  """Thread-safe token bucket used to pace requests to the same target"""
+
+  def __init__(self, rate, capacity=1):
+    # rate is in tokens per second, 0 (or less) disables pacing
+    self._rate = rate
+    self._capacity = capacity
+    self._tokens = capacity
+    self._updated = time.monotonic()
+    self._lock = threading.Lock()
+
+  def reserve(self):
+    """Take one token and return how many seconds the caller should wait before using it"""
+    if self._rate <= 0:
+      return 0
+    with self._lock:
+      now = time.monotonic()
+      self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+      self._updated = now
+      # tokens can go negative, which queues callers behind earlier reservations
+      self._tokens -= 1
+      if self._tokens >= 0:
+        return 0
+      return -self._tokens / self._rate
+
+  def acquire(self):
+    """Block until a token is available"""
+    delay = self.reserve()
+    if delay > 0:
+      time.sleep(delay)
+
+class CircuitBreaker:
+  """Per host circuit breaker: opens after consecutive connect failures, half-opens with one TCP probe"""
+
+  _lock = threading.Lock()
+  _hosts = {}  # (host, port) -> {"failures", "open_until", "cooldown", "probing"}
+  _threshold = 3      # consecutive connect failures before opening
+  _cooldown = 60      # seconds before the first half-open probe, doubled on each failed probe
+  _max_cooldown = 900
+  _probe_timeout = 5
+  _opened = 0
+  _closed = 0
+  _short_circuited = 0
+
+  @staticmethod
+  def configure(threshold=None, cooldown=None, max_cooldown=None, probe_timeout=None):
+    if threshold is not None:
+      CircuitBreaker._threshold = threshold
+    if cooldown is not None:
+      CircuitBreaker._cooldown = cooldown
+    if max_cooldown is not None:
+      CircuitBreaker._max_cooldown = max_cooldown
+    if probe_timeout is not None:
+      CircuitBreaker._probe_timeout = probe_timeout
+
+  @staticmethod
+  def _get_key(url):
+    parsed = urllib.parse.urlparse(url)
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    return (parsed.hostname or "").lower(), port
+
+  @staticmethod
+  def is_connect_failure(error):
+    """True if the request failed before a connection was established (not DNS, TLS or read errors)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+      return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+      reason = getattr(error.args[0], "reason", error.args[0])
+      # DNS failures are chained from gaierror (NameResolutionError only exists in urllib3 2.x)
+      is_dns_failure = (_NameResolutionError and isinstance(reason, _NameResolutionError)) \
+        or isinstance(reason.__cause__, socket.gaierror)
+      return isinstance(reason, (urllib3.exceptions.NewConnectionError, urllib3.exceptions.ConnectTimeoutError)) \
+        and not is_dns_failure
+    return False
+
+  @staticmethod
+  def allow(url):
+    """Check if a request to url may go ahead, probing the host if its breaker is due to half-open"""
+    if CircuitBreaker._threshold <= 0:
+      return True
+    key = CircuitBreaker._get_key(url)
+    with CircuitBreaker._lock:
+      state = CircuitBreaker._hosts.get(key)
+      if not state or state["failures"] < CircuitBreaker._threshold:
+        return True
+      if state["probing"] or time.monotonic() < state["open_until"]:
+        CircuitBreaker._short_circuited += 1
+        return False
+      # half-open: only this caller probes, others keep failing fast
+      state["probing"] = True
+    try:
+      WebUtils.create_connection(key[0], key[1], CircuitBreaker._probe_timeout).close()
+      CircuitBreaker.record_success(url)
+      return True
+    except Exception as e:
+      with CircuitBreaker._lock:
+        state["probing"] = False
+        state["cooldown"] = min(CircuitBreaker._max_cooldown, state["cooldown"] * 2)
+        state["open_until"] = time.monotonic() + state["cooldown"]
+        CircuitBreaker._short_circuited += 1
+      logger.debug(f"Circuit for {key[0]}:{key[1]} stays open for {state['cooldown']}s: {e}")
+      return False
+
+  @staticmethod
+  def record_success(url):
+    key = CircuitBreaker._get_key(url)
+    with CircuitBreaker._lock:
+      state = CircuitBreaker._hosts.pop(key, None)
+      if state and state["failures"] >= CircuitBreaker._threshold:
+        CircuitBreaker._closed += 1
+        logger.info(f"Circuit for {key[0]}:{key[1]} closed, host is reachable again")
+
+  @staticmethod
+  def record_failure(url):
+    key = CircuitBreaker._get_key(url)
+    with CircuitBreaker._lock:
+      state = CircuitBreaker._hosts.setdefault(key, {"failures": 0, "open_until": 0, "cooldown": 0, "probing": False})
+      state["failures"] += 1
+      if state["failures"] == CircuitBreaker._threshold:
+        CircuitBreaker._opened += 1
+        state["cooldown"] = CircuitBreaker._cooldown
+        state["open_until"] = time.monotonic() + state["cooldown"]
+        logger.warning(f"Circuit for {key[0]}:{key[1]} opened after {state['failures']} connect failures")
+
+  @staticmethod
+  def get_failures(url):
+    with CircuitBreaker._lock:
+      state = CircuitBreaker._hosts.get(CircuitBreaker._get_key(url))
+      return state["failures"] if state else 0
+
+  @staticmethod
+  def get_stats():
+    """Get transition counters as a dict"""
+    with CircuitBreaker._lock:
+      return {
+        "opened": CircuitBreaker._opened,
+        "closed": CircuitBreaker._closed,
+        "short_circuited": CircuitBreaker._short_circuited,
+        "open": sum(1 for state in CircuitBreaker._hosts.values() if state["failures"] >= CircuitBreaker._threshold)
+      }
+
+class GeoLocator:
+  """IP to (city, region, country) from a disk cache, an optional MMDB file, then ipinfo batch lookups"""
+
+  _lock = threading.Lock()
+  _entries = {}       # ip -> {"city", "region", "country", "time"}
+  _cache_file = None
+  _loaded = False
+  _ttl = 30 * 86400   # locations of an IP rarely change
+  _mmdb_file = None
+  _mmdb_reader = None
+  _batch_size = 1000  # ipinfo batch endpoint limit
+  _max_single_lookups = 20  # per call without an ipinfo token, the rest waits for later runs
+  _single_lookup_bucket = None
+
+  @staticmethod
+  def configure(cache_file=None, ttl_days=None, mmdb_file=None):
+    with GeoLocator._lock:
+      if cache_file is not None and cache_file != GeoLocator._cache_file:
+        GeoLocator._cache_file = cache_file
+        GeoLocator._loaded = False
+      if ttl_days is not None:
+        GeoLocator._ttl = ttl_days * 86400
+      if mmdb_file is not None and mmdb_file != GeoLocator._mmdb_file:
+        GeoLocator._mmdb_file = mmdb_file
+        GeoLocator._mmdb_reader = None
+
+  @staticmethod
+  def _load():
+    if GeoLocator._loaded:
+      return
+    GeoLocator._loaded = True
+    try:
+      if GeoLocator._cache_file and os.path.isfile(GeoLocator._cache_file):
+        with open(GeoLocator._cache_file, "r") as f:
+          GeoLocator._entries = json.load(f)
+        logger.debug(f"IP location cache loaded: {len(GeoLocator._entries)} addresses.")
+    except Exception as e:
+      logger.warning(f"Ignoring IP location cache [{GeoLocator._cache_file}]: {e}")
+
+  @staticmethod
+  def _save():
+    if not GeoLocator._cache_file:
+      return
+    try:
+      WebUtils.save_json(GeoLocator._cache_file, GeoLocator._entries)
+    except Exception as e:
+      logger.warning(f"Failed to save IP location cache [{GeoLocator._cache_file}]: {e}")
+
+  @staticmethod
+  def _lookup_mmdb(ips):
+    """Look up a MaxMind/DB-IP city database if configured (needs the optional maxminddb package)"""
+    if not GeoLocator._mmdb_file:
+      return {}
+    try:
+      if not GeoLocator._mmdb_reader:
+        import maxminddb
+        GeoLocator._mmdb_reader = maxminddb.open_database(GeoLocator._mmdb_file)
+    except Exception as e:
+      logger.warning(f"Cannot open IP location database [{GeoLocator._mmdb_file}]: {e}")
+      GeoLocator._mmdb_file = None
+      return {}
+    locations = {}
+    for ip in ips:
+      try:
+        record = GeoLocator._mmdb_reader.get(ip)
+      except Exception:
+        continue
+      if not record:
+        continue
+      subdivisions = record.get("subdivisions") or [{}]
+      locations[ip] = (record.get("city", {}).get("names", {}).get("en"),
+                       subdivisions[0].get("names", {}).get("en"),
+                       record.get("country", {}).get("iso_code"))
+    return locations
+
+  @staticmethod
+  def _lookup_ipinfo(ips):
+    """Batch lookup with IPINFO_TOKEN, otherwise a few paced single lookups"""
+    locations = {}
+    headers = {"User-Agent": WebUtils._USER_AGENT}
+    token = os.environ.get("IPINFO_TOKEN", "").strip('" ')
+    session = HTTPSessions.get_session()
+    if token:
+      for start in range(0, len(ips), GeoLocator._batch_size):
+        batch = ips[start:start + GeoLocator._batch_size]
+        try:
+          r = session.post("https://ipinfo.io/batch", params={"token": token}, json=batch, headers=headers, timeout=30)
+          if r.status_code >= 400:
+            logger.warning(f"IP location batch lookup failed (status={r.status_code})")
+            break
+          for ip, data in r.json().items():
+            if isinstance(data, dict):
+              locations[ip] = (data.get("city"), data.get("region"), data.get("country"))
+        except Exception as e:
+          logger.warning(f"IP location batch lookup failed: {e}")
+          break
+      return locations
+    if not GeoLocator._single_lookup_bucket:
+      # avoid throttling of anonymous lookups
+      GeoLocator._single_lookup_bucket = TokenBucket(0.5)
+    for ip in ips[:GeoLocator._max_single_lookups]:
+      try:
+        GeoLocator._single_lookup_bucket.acquire()
+        r = session.get(f"https://ipinfo.io/{ip}/json", headers=headers, timeout=10)
+        if r.status_code >= 400:
+          logger.warning(f"Failed to get location of IP: {ip} (status={r.status_code})")
+          break
+        data = r.json()
+        locations[ip] = (data.get("city"), data.get("region"), data.get("country"))
+      except Exception as e:
+        # service unreachable, no point trying the other IPs now
+        logger.warning(f"Failed to get location of IP: {ip} ({e})")
+        break
+    return locations
+
+  @staticmethod
+  def locate(ips):
+    """Get {ip: (city, region, country)} for the given IPs, unknown ones are left out"""
+    locations = {}
+    with GeoLocator._lock:
+      GeoLocator._load()
+      now = time.time()
+      missing = []
+      for ip in dict.fromkeys(ip for ip in ips if ip):
+        try:
+          if not ipaddress.ip_address(ip).is_global:
+            continue
+        except ValueError:
+          continue
+        entry = GeoLocator._entries.get(ip)
+        if entry and now - entry["time"] < GeoLocator._ttl:
+          locations[ip] = (entry["city"], entry["region"], entry["country"])
+        else:
+          missing.append(ip)
+      if not missing:
+        return locations
+      found = GeoLocator._lookup_mmdb(missing)
+      remaining = [ip for ip in missing if ip not in found]
+      if remaining:
+        found.update(GeoLocator._lookup_ipinfo(remaining))
+      for ip, (city, region, country) in found.items():
+        GeoLocator._entries[ip] = {"city": city, "region": region, "country": country, "time": now}
+      if found:
+        GeoLocator._save()
+      locations.update(found)
+      return locations
+
+# start with the user agent cached by any earlier run
+WebUtils._load_cached_user_agent()
+
 # Provide module-level functions for backward compatibility
-def get_latest_user_agent():
-  return WebUtils.get_latest_user_agent()
+def get_latest_user_agent(background=True):
+  return WebUtils.get_latest_user_agent(background)
+
+def configure_user_agent(cache_file=None, retry_delay=None):
+  return WebUtils.configure_user_agent(cache_file, retry_delay)
+
+def save_json(path, data, **kwargs):
+  return WebUtils.save_json(path, data, **kwargs)
 
-def is_host_reachable(url):
-  return WebUtils.is_host_reachable(url)
+def is_host_reachable(url, timeout=10):
+  return WebUtils.is_host_reachable(url, timeout)
+
+def probe_endpoints(host, port, timeout=10, resolver=None):
+  return WebUtils.probe_endpoints(host, port, timeout, resolver)
 
 def get_ip_addresses(host, port):
   return WebUtils.get_ip_addresses(host, port)
@@ -162,3 +982,54 @@ def get_user_agent():
 
 def set_user_agent(new_user_agent):
   return WebUtils.set_user_agent(new_user_agent)
+
+def create_connection(host, port, timeout=None):
+  return WebUtils.create_connection(host, port, timeout)
+
+def configure_dns_cache(default_ttl=None, negative_ttl=None, nameservers=None):
+  return DNSCache.configure(default_ttl, negative_ttl, nameservers)
+
+def flush_dns_cache(host=None):
+  return DNSCache.flush(host)
+
+def get_dns_stats():
+  return DNSCache.get_stats()
+
+def get_http_session():
+  return HTTPSessions.get_session()
+
+def configure_http_sessions(pool_connections=None, pool_maxsize=None, retries=None, timeout=None):
+  return HTTPSessions.configure(pool_connections, pool_maxsize, retries, timeout)
+
+def get_phase_timings(response):
+  return HTTPSessions.get_phase_timings(response)
+
+def get_peer_info(response):
+  return HTTPSessions.get_peer_info(response)
+
+def get_http_stats():
+  return HTTPSessions.get_stats()
+
+def configure_circuit_breaker(threshold=None, cooldown=None, max_cooldown=None, probe_timeout=None):
+  return CircuitBreaker.configure(threshold, cooldown, max_cooldown, probe_timeout)
+
+def circuit_allows(url):
+  return CircuitBreaker.allow(url)
+
+def record_circuit_success(url):
+  return CircuitBreaker.record_success(url)
+
+def record_circuit_failure(url):
+  return CircuitBreaker.record_failure(url)
+
+def is_connect_failure(error):
+  return CircuitBreaker.is_connect_failure(error)
+
+def get_circuit_stats():
+  return CircuitBreaker.get_stats()
+
+def configure_geolocation(cache_file=None, ttl_days=None, mmdb_file=None):
+  return GeoLocator.configure(cache_file, ttl_days, mmdb_file)
+
+def get_ip_locations(ips):
+  return GeoLocator.locate(ips)